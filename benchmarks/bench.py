@@ -0,0 +1,144 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Benchmarks of otsdb_client against the local mock TSD.
+
+Measures the put throughput across batch sizes (ptcl), the query parse time
+against the response size and the memory peak of each case. Run it from the
+repository root:
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --points 100000 --ptcl 50,500 --json results.json
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+from json import dump, loads
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from otsdb_client.mockserver import MockTSD
+
+
+def measure(fn, repeat=3):
+    """ Best wall time of <fn> over <repeat> runs and its memory peak. """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def bench_put(conn, points, series, ptcls, repeat):
+    per_serie = max(points // series, 1)
+    ts = list(range(1500000000, 1500000000 + per_serie))
+    data = [('bench.put', ts, [float(i) for i in range(per_serie)], {'serie': str(s)})
+            for s in range(series)]
+    rows = []
+
+    elapsed, peak = measure(lambda: data and [conn._put_points(*s) for s in data], repeat)
+    rows.append({'case': 'encode', 'points': per_serie * series,
+        'seconds': elapsed, 'points/s': per_serie * series / elapsed, 'peak_mb': peak / 1e6})
+
+    for ptcl in ptcls:
+        elapsed, peak = measure(lambda: conn.put_bulk(series=data, ptcl=ptcl,
+            verbose=False), repeat)
+        rows.append({'case': 'put ptcl=%d' % ptcl, 'points': per_serie * series,
+            'seconds': elapsed, 'points/s': per_serie * series / elapsed,
+            'peak_mb': peak / 1e6})
+    return rows
+
+
+def bench_query(Connection, sizes, repeat):
+    rows = []
+    query = [{'m': 'bench.query', 'aggr': 'sum', 'tags': {}}]
+    for size in sizes:
+        proc, port = MockTSD.spawn(synthetic=size)
+        try:
+            conn = Connection(port=port)
+            start = 1500000000
+            end = start + size
+            resp = conn._post('query', conn._query_payload(query, start, end))
+            text = resp.text
+            data = loads(text)
+
+            for name, fn in [
+                    ('parse json', lambda: loads(text)),
+                    ('assemble lists', lambda: conn._query_result(loads(text), tsd=False)),
+                    ('assemble arrays', lambda: conn._query_arrays(loads(text))),
+                    ('query end-to-end', lambda: conn.query(query, start, end, tsd=False))]:
+                elapsed, peak = measure(fn, repeat)
+                rows.append({'case': '%s (%d points)' % (name, len(data[0]['dps'])),
+                    'points': len(data[0]['dps']), 'bytes': len(text), 'seconds': elapsed,
+                    'points/s': len(data[0]['dps']) / elapsed, 'peak_mb': peak / 1e6})
+            conn.close()
+        finally:
+            proc.kill()
+            proc.wait()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--points', type=int, default=20000,
+        help='points written by each put case')
+    parser.add_argument('--series', type=int, default=100,
+        help='series the points are spread over')
+    parser.add_argument('--ptcl', default='10,50,200,1000',
+        help='batch sizes of the put cases')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+        help='points per query response')
+    parser.add_argument('--latency', type=float, default=0,
+        help='latency of the mock TSD in seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='also writes the results to this file')
+    args = parser.parse_args(argv)
+
+    # The client monkey-patches the process: the mock TSD runs in another one
+    from otsdb_client import Connection
+
+    rows = []
+    proc, port = MockTSD.spawn(latency=args.latency)
+    try:
+        conn = Connection(port=port)
+        rows += bench_put(conn, args.points, args.series,
+            [int(x) for x in args.ptcl.split(',')], args.repeat)
+        conn.close()
+    finally:
+        proc.kill()
+        proc.wait()
+    rows += bench_query(Connection, [int(x) for x in args.sizes.split(',')], args.repeat)
+
+    print('%-36s %10s %10s %12s %9s' % ('case', 'points', 'seconds', 'points/s', 'peak MB'))
+    for r in rows:
+        print('%-36s %10d %10.4f %12.0f %9.2f' % (r['case'], r['points'], r['seconds'],
+            r['points/s'], r['peak_mb']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            dump({'python': sys.version, 'args': vars(args), 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,17 @@
-from otsdb_client.client import Connection
+# The classes are imported on first access: importing the package (e.g. to
+# use AsyncConnection) must not import grequests, which monkey-patches the
+# standard library with gevent.
+__all__ = ['Connection', 'ClusterConnection', 'AsyncConnection']
+
+
+def __getattr__(name):
+    if name == 'Connection':
+        from otsdb_client.client import Connection
+        return Connection
+    if name == 'ClusterConnection':
+        from otsdb_client.cluster import ClusterConnection
+        return ClusterConnection
+    if name == 'AsyncConnection':
+        from otsdb_client.aio import AsyncConnection
+        return AsyncConnection
+    raise AttributeError("module 'otsdb_client' has no attribute %r" % name)
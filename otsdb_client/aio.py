@@ -0,0 +1,541 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+from json import loads
+from logging import info
+
+from otsdb_client.base import BaseConnection
+from otsdb_client.cache import QueryCache
+from otsdb_client.metadata import SHARED
+from otsdb_client.metrics import Metrics
+from otsdb_client.ratelimit import RateLimiter
+from otsdb_client.retry import RetryPolicy
+from otsdb_client.stream import ArrayParser
+from otsdb_client.suggest import SuggestIndex
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+async def ping(host, port):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.close()
+        await writer.wait_closed()
+        info('Ping in '+host+':'+str(port) + " OpenTSDB Server: Ok")
+        return True
+    except ConnectionRefusedError:
+        raise Exception('Can\'t connect to OpenTSDB Server')
+    except OSError:
+        raise Exception('Fail to test OpenTSDB connection status')
+
+
+class AsyncConnection(BaseConnection):
+    """ asyncio counterpart of :class:`otsdb_client.client.Connection`.
+
+    The endpoint methods are coroutines and share the payload builders of
+    ``Connection``. It does not import grequests, so gevent never patches the
+    standard library. Requires the aiohttp package.
+
+    Parameters
+    ----------
+    'server' : string, optional (default=localhost)
+        The IP address or URI of the server.
+
+    'port' : int, optional (default=4242)
+        The port that TSD is running.
+
+    'concurrency' : int, optional (default=10)
+        Maximum number of requests in flight for one put call.
+
+    'pool_maxsize' : int, optional (default=100)
+        Maximum number of connections kept open.
+
+    'keep_alive' : boolean, optional (default=True)
+        Reuse the HTTP connections between requests.
+
+    'timeout' : float, optional (default=None)
+        Total timeout in seconds of every HTTP request.
+
+    'cache' : QueryCache or boolean, optional (default=None)
+        Caches the responses of query and query_expressions.
+
+    'retry' : RetryPolicy, optional (default=None)
+        The retry policy of put.
+
+    'compress' : boolean or int, optional (default=False)
+        Gzips the bodies of put. An int sets the compression level (1-9),
+        True uses level 1.
+
+    'metrics' : Metrics, optional (default=None)
+        The registry recording the requests, retries and points.
+
+    'metadata' : MetadataCache, optional (default=None)
+        Caches the aggregators, filters and version of the server. By default
+        the cache is shared by the connections of the process.
+
+    'index' : SuggestIndex or boolean, optional (default=None)
+        Answers suggest from a local index of the names, loaded on the first
+        call and again in background once older than its refresh interval.
+
+    'ratelimit' : RateLimiter or boolean, optional (default=None)
+        Paces the /api/put requests (points and requests per second, adaptive
+        concurrency replacing <concurrency>). True adapts the concurrency only.
+
+    Example
+    -------
+    >>> async with AsyncConnection(server='localhost') as c:
+    ...     await c.put(metric='sys.mem.used', values=[4321], tags={'host': 'server1'})
+    """
+
+    def __init__(self, server='localhost', port=4242, concurrency=10,
+        pool_maxsize=100, keep_alive=True, timeout=None, cache=None, retry=None,
+        compress=False, metrics=None, metadata=None, index=None, ratelimit=None):
+        assert aiohttp is not None, \
+            'AsyncConnection requires the aiohttp package.'
+        assert concurrency > 0, 'Field <concurrency> must be greater than 0.'
+        assert compress is True or compress is False or 0 <= compress <= 9, \
+            'Field <compress> must be a boolean or a level between 0 and 9.'
+
+        self.server = server
+        self.port = port
+        self.url = 'http://%s:%d' % (server, port)
+        self.headers = {'content-type': "application/json"}
+        self.concurrency = concurrency
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.cache = QueryCache() if cache is True else (cache or None)
+        self.retry = retry
+        self.compress = 1 if compress is True else int(compress)
+        self.metrics = metrics or Metrics()
+        self.metadata = metadata or SHARED
+        self.index = SuggestIndex() if index is True else (index or None)
+        self.ratelimit = RateLimiter() if ratelimit is True else (ratelimit or None)
+        if self.ratelimit is not None:
+            self.metrics.gauge('put.concurrency', lambda: self.ratelimit.limit)
+        self._aggregators = None
+        self.ids = {"filter": {}, "metric": {}}
+        self._session = None
+        self._index_load = None
+
+    async def connect(self):
+        """ Pings the server and loads the aggregators, unless they are in
+        the metadata cache. """
+        if not self.metadata.get(self.url, 'ping'):
+            self.metadata.put(self.url, 'ping', await ping(self.server, self.port))
+        self._aggregators = None
+        await self._load_aggregators()
+        return self
+
+    async def _load_aggregators(self):
+        """ Loads the aggregators on first use, from the metadata cache or
+        the server. The queries call it, so connect() is optional. """
+        if self._aggregators is None:
+            self._aggregators = self.metadata.get(self.url, 'aggregators')
+        if not self._aggregators:
+            self._aggregators = await self.get_aggregators()
+            self.metadata.put(self.url, 'aggregators', self._aggregators)
+
+    @property
+    def aggregators(self):
+        assert self._aggregators is not None, \
+            'The aggregators are not loaded: call connect() or run a query first.'
+        return self._aggregators
+
+    @aggregators.setter
+    def aggregators(self, value):
+        self._aggregators = value
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """ Closes the pooled HTTP connections. """
+        if self._index_load is not None:
+            self._index_load.cancel()
+            self._index_load = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _client(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    @asynccontextmanager
+    async def _open(self, method, endpoint="", query='', **kwargs):
+        """ Sends one request and yields its response, whose body the caller
+        reads. The request is recorded in the metrics once the response is
+        released, with the bytes read. """
+        data = kwargs.get('data')
+        started = time.time()
+        resp = None
+        try:
+            async with self._client().request(method,
+                    self.url + self.get_endpoint(endpoint) + query, **kwargs) as resp:
+                yield resp
+        finally:
+            self.metrics.request(endpoint, resp.status if resp is not None else None,
+                len(data) if data else 0,
+                resp.content.total_bytes if resp is not None else 0,
+                time.time() - started)
+
+    async def _fetch(self, method, endpoint="", query='', **kwargs):
+        """ Sends one request and returns its (status, text), or (None, None)
+        when the request fails. """
+        try:
+            async with self._open(method, endpoint, query, **kwargs) as resp:
+                return resp.status, await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            info('Request to %s failed: %s' % (self.url + self.get_endpoint(endpoint), err))
+            return None, None
+
+    async def _get(self, endpoint="", params=dict()):
+        return await self._fetch('GET', endpoint, params=params)
+
+    async def _post(self, endpoint="", data=dict()):
+        assert isinstance(data, dict), 'Field <data> must be a dict.'
+        return await self._fetch('POST', endpoint, data=self.dumps(data),
+            headers=self.headers)
+
+    async def _post_many(self, endpoint, payloads, concurrency=4, att=3, partial=False):
+        """ Posts the payloads concurrently, at most <concurrency> at a time.
+
+        See :meth:`otsdb_client.client.Connection._post_many`. Returns the
+        response texts in the order of <payloads>, or None.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(payload):
+            async with semaphore:
+                return await self._post(endpoint, payload)
+
+        texts = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+        attempts = 0
+        while pending and attempts < att:
+            resps = await asyncio.gather(*[send(payloads[i]) for i in pending])
+
+            failed = []
+            for i, (status, text) in zip(pending, resps):
+                if status is not None and 200 <= status < 300:
+                    texts[i] = text
+                elif status is not None and status < 500:
+                    info("HTTP error code = %d" % status)
+                    if not partial:
+                        return None
+                    texts[i] = False
+                else:
+                    failed.append(i)
+            pending = failed
+            attempts += 1
+
+        return None if pending and not partial else texts
+
+    async def _get_json(self, endpoint, params=dict()):
+        status, text = await self._get(endpoint, params)
+        if status is None:
+            return False
+        return self._process(status, text)
+
+    async def filters(self):
+        """ Lists the various filters loaded by the TSD (cached) """
+        return await self._cached("filters")
+
+    async def statistics(self):
+        """Get info about what metrics are registered and with what stats."""
+        return await self._get_json("stats")
+
+    async def get_aggregators(self):
+        """Used to get the list of default aggregation functions. """
+        return await self._get_json("aggr")
+
+    async def version(self):
+        """Used to check OpenTSDB version (cached). """
+        return await self._cached("version")
+
+    async def _cached(self, endpoint):
+        value = self.metadata.get(self.url, endpoint)
+        if not value:
+            value = await self._get_json(endpoint)
+            self.metadata.put(self.url, endpoint, value)
+        return value
+
+    async def suggest(self, type='metrics', q='', max=9999):
+        """ Matches the string in the query on the first chars of the stored data.
+
+        See :meth:`otsdb_client.client.Connection.suggest`.
+        """
+        if self.index is not None:
+            if self.index.stale() and (self._index_load is None or self._index_load.done()):
+                self._index_load = asyncio.ensure_future(self._load_index())
+            if not self.index.loaded:
+                await self._index_load
+            found = self.index.lookup(type, q, max)
+            if found is not None:
+                return found
+        return await self._get_json("suggest", self._suggest_params(type, q, max))
+
+    async def _load_index(self):
+        names = {}
+        for t in SuggestIndex.TYPES:
+            names[t] = await self._get_json("suggest",
+                self._suggest_params(t, '', self.index.limit))
+        self.index.load(lambda t, limit: names[t])
+
+    async def put(self, metric=None, timestamps=[], values=[], tags=dict(),
+        details=True, verbose=True, ptcl=20, att=5):
+        """ Put time serie points into OpenTSDB over HTTP.
+
+        The batches are sent concurrently, at most <concurrency> at a time.
+        See :meth:`otsdb_client.client.Connection.put` for the parameters.
+        """
+        points = self._put_points(metric, timestamps, values, tags)
+        batches = self._batches(points, ptcl)
+        failed = await self._put_batches(batches, att=att, verbose=verbose,
+            details=details)
+        return self._put_summary(points, failed, verbose)
+
+    async def put_bulk(self, series=None, points=None, details=True, verbose=False,
+        ptcl=50, att=5):
+        """ Put the points of many time series into OpenTSDB over HTTP.
+
+        The points are packed in full batches sent concurrently, at most
+        <concurrency> at a time. See
+        :meth:`otsdb_client.client.Connection.put_bulk` for the parameters.
+        """
+        points = self._bulk_points(series, points)
+        batches = self._batches(points, ptcl)
+        failed = await self._put_batches(batches, att=att, verbose=verbose,
+            details=details)
+        return self._put_summary(points, failed, verbose)
+
+    async def _put_batches(self, batches, att=5, verbose=False, details=True):
+        """ Sends batches of encoded points to /api/put.
+
+        See :meth:`otsdb_client.client.Connection._put_batches`. Returns the
+        number of points that could not be stored.
+        """
+        policy = self.retry or RetryPolicy(attempts=att)
+        query = '?details=true' if details else '?summary=true'
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = self.ratelimit
+
+        async def send(batch):
+            if limiter is None:
+                async with semaphore:
+                    data, headers = self._put_body(batch)
+                    return await self._fetch('POST', "put", query, data=data,
+                        headers=headers)
+            while True:
+                delay, ticket = limiter.acquire(len(batch))
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+            started = time.time()
+            status, text = None, None
+            try:
+                data, headers = self._put_body(batch)
+                status, text = await self._fetch('POST', "put", query, data=data,
+                    headers=headers)
+            finally:
+                limiter.release(ticket, status, time.time() - started)
+            return status, text
+
+        pending = [b for b in batches if b]
+        size = max(map(len, pending)) if pending else 1
+        failed = 0
+        attempt = 0
+        while pending:
+            resps = await asyncio.gather(*[send(b) for b in pending])
+            attempt += 1
+
+            if verbose:
+                print('Attempt %d: Request submitted with HTTP status codes %s' \
+                    % (attempt, str([status for status, _ in resps])))
+
+            retry = []
+            for b, (status, text) in zip(pending, resps):
+                points, lost = self._put_outcome(b, status, text, policy)
+                failed += lost
+                if points:
+                    retry.append(points)
+            pending = self._batches([p for b in retry for p in b], size)
+
+            if pending and attempt >= policy.attempts:
+                failed += sum(len(b) for b in pending)
+                break
+            if pending:
+                self.metrics.incr('put.retries', sum(map(len, pending)))
+                await asyncio.sleep(policy.delay(attempt))
+
+        self.metrics.incr('put.points', sum(map(len, batches)) - failed)
+        if failed:
+            self.metrics.incr('put.failed', failed)
+        return failed
+
+    async def query(self, queries=[], start='1h-ago', end='now', show_summary=False,
+        show_json=False, nots=False, tsd=True, group=False, arrays=False,
+        chunk=None, concurrency=4, att=3, compact=False):
+        """ Enables extracting data from the storage system
+
+        See :meth:`otsdb_client.client.Connection.query`.
+        """
+        await self._load_aggregators()
+        data = self._query_payload(queries, start, end, show_summary)
+        res = self._cache_get("query", data, start, end)
+        if res is None:
+            if chunk:
+                payloads = self._query_windows(data, start, end, chunk)
+                texts = await self._post_many("query", payloads, concurrency, att)
+                if texts is not None:
+                    res = self._merge_query([loads(t) for t in texts])
+            else:
+                status, text = await self._post(endpoint="query", data=data)
+                if status is not None and 200 <= status <= 300:
+                    if show_json and self.cache is None:
+                        # Raw response
+                        return text
+                    res = loads(text)
+
+            if res is None:
+                print('No results found')
+                return []
+            self._cache_put("query", data, start, end, res)
+
+        if show_json:
+            return self.dumps(res)
+        return self._query_result(res, nots=nots, tsd=tsd, group=group,
+            show_summary=show_summary, arrays=arrays, compact=compact)
+
+    async def query_many(self, specs=[], nots=False, tsd=True, arrays=False, pack=20,
+        concurrency=4, att=3, compact=False):
+        """ Runs many independent queries, packing the ones that share a time
+        window. See :meth:`otsdb_client.client.Connection.query_many`. """
+        await self._load_aggregators()
+        datas, res, packed = self._query_many_plan(specs, pack)
+        while packed:
+            texts = await self._post_many("query", [p for p, _ in packed], concurrency,
+                att, partial=True)
+            retry = []
+            for (_, parts), text in zip(packed, texts):
+                if text is False and len(parts) > 1:
+                    retry += [(dict(datas[n], showQuery=True), [(n, 0)]) for n, _ in parts]
+                if not text:
+                    continue
+                for n, series in self._query_many_split(loads(text), parts).items():
+                    res[n] = series
+                    self._cache_put("query", datas[n], specs[n].get('start', '1h-ago'),
+                        specs[n].get('end', 'now'), series)
+            packed = retry
+
+        return [self._query_result(res[n], nots=nots, tsd=tsd,
+                    group=spec.get('group', False), arrays=arrays, compact=compact)
+                if n in res else []
+                for n, spec in enumerate(specs)]
+
+    async def query_stream(self, queries=[], start='1h-ago', end='now', nots=False,
+        tsd=True, arrays=False, batch=None, chunk_size=65536):
+        """ Streams the series of a query while the response is downloaded.
+
+        Asynchronous generator, see :meth:`otsdb_client.client.Connection.query_stream`.
+        """
+        await self._load_aggregators()
+        data = self._query_payload(queries, start, end)
+        parser = ArrayParser()
+        async with self._open('POST', "query", data=self.dumps(data),
+                headers=self.headers) as resp:
+            if not 200 <= resp.status <= 300:
+                info("HTTP error code = %d" % resp.status)
+                return
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                for item in self._stream_result(parser.feed(chunk), nots=nots,
+                        tsd=tsd, arrays=arrays, batch=batch):
+                    yield item
+        parser.close()
+
+    async def query_expressions(self, aggr='sum', start='1d-ago', end='now', vpol="nan",
+        metrics=[], exprs=[], dsampler=None, forceAggregate=False, chunk=None,
+        concurrency=4, att=3):
+        """ Allows for querying data using expressions.
+
+        See :meth:`otsdb_client.client.Connection.query_expressions`.
+        """
+        await self._load_aggregators()
+        data = self._query_exp_payload(aggr=aggr, start=start, end=end,
+            vpol=vpol, metrics=metrics, exprs=exprs, dsampler=dsampler)
+
+        res = self._cache_get("query_exp", data, start, end)
+        if res is None:
+            if chunk:
+                # Windows cut on the downsample buckets, so none spans a seam
+                payloads = [dict(data, time=dict(data['time'], start=s, end=e))
+                            for s, e in self._time_windows(start, end, chunk,
+                                dsampler[0] if dsampler else None)]
+                texts = await self._post_many("query_exp", payloads, concurrency, att)
+                if texts is None:
+                    return False
+                res = self._merge_exp([self._process(200, t) for t in texts])
+            else:
+                status, text = await self._post(endpoint="query_exp", data=data)
+                if status is None:
+                    return False
+                res = self._process(status, text)
+            if res:
+                self._cache_put("query_exp", data, start, end, res)
+
+        return self._exp_result(res, forceAggregate == True)
+
+    async def query_summing(self, aggr='sum', start='1d-ago', end='now', vpol="nan",
+        metrics=[], dsampler=None, split=100, concurrency=4, att=3):
+        """ Sum all required metrics using query with expressions.
+
+        See :meth:`otsdb_client.client.Connection.query_summing`.
+        """
+        await self._load_aggregators()
+        parts = self._summing_parts(metrics, split)
+        if len(parts) == 1:
+            return await self.query_expressions(aggr='sum', start=start, end=end, vpol=vpol,
+                metrics=metrics, exprs=parts[0][1], dsampler=dsampler, forceAggregate=True)
+
+        payloads = [self._query_exp_payload(aggr='sum', start=start, end=end,
+            vpol=vpol, metrics=m, exprs=e, dsampler=dsampler) for m, e in parts]
+        results = [self._cache_get("query_exp", p, start, end) for p in payloads]
+        missing = [n for n, r in enumerate(results) if r is None]
+        if missing:
+            texts = await self._post_many("query_exp", [payloads[n] for n in missing],
+                concurrency, att)
+            if texts is None:
+                return False
+            for n, t in zip(missing, texts):
+                results[n] = self._process(200, t)
+                if not results[n]:
+                    return results[n]
+                self._cache_put("query_exp", payloads[n], start, end, results[n])
+        return self._combine_sums(results, [len(m) for m, _ in parts], vpol)
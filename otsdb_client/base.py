@@ -0,0 +1,740 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+from bisect import bisect_right
+from copy import deepcopy
+from datetime import datetime
+
+from json import dumps as tdumps, loads
+from logging import info
+
+from otsdb_client import columns, encoder, timeutil
+
+# Compiled bodies of /api/query/exp, see BaseConnection._compile_exp
+_exp_plans = {}
+_MAX_EXP_PLANS = 256
+
+
+class BaseConnection(object):
+    """ Payload builders and response handling shared by the connection classes.
+
+    Subclasses implement the transport (HTTP requests) and the public endpoint
+    methods on top of these helpers.
+    """
+
+    def get_endpoint(self, key=""):
+        endpoint = '/api' + {
+            'filters': '/config/filters',
+            'query_exp': '/query/exp',
+            'aggr': '/aggregators',
+            'suggest': '/suggest',
+            'version': '/version',
+            'put': '/put',
+            'query': '/query',
+            'stats': '/stats',
+        }.get(str(key))
+
+        assert endpoint != '/api', \
+            "Please provide a valid endpoint."
+        return endpoint
+
+    def _process(self, status, text):
+        if not (200 <= status < 300):
+            info("HTTP error code = %d" % status)
+            return False
+
+        data = loads(text)
+        return data if data else None
+
+    def _suggest_params(self, type='metrics', q='', max=9999):
+        assert type in ['metrics', 'tagk', 'tagv'], \
+            'Field <type> must be metrics, tagk or tagv.'
+        return {'type': type, 'q': q, 'max': max}
+
+    def _put_points(self, metric, timestamps, values, tags):
+        """ Validates the arguments of put and returns its encoded points.
+
+        <timestamps> and <values> may be lists or buffers (NumPy arrays,
+        ``array.array``), which are converted in a single vectorized step.
+        """
+        assert isinstance(metric, str), 'Field <metric> must be a string.'
+        assert columns.is_column(values), 'Field <values> must be a list or an array.'
+        assert columns.is_column(timestamps), \
+            'Field <timestamps> must be a list or an array.'
+
+        if len(timestamps) > 0:
+            assert len(timestamps) == len(values), \
+                'Field <timestamps> dont fit field <values>.'
+            if columns.is_buffer(timestamps):
+                timestamps = columns.timestamps(timestamps)
+            else:
+                assert all(isinstance(x, (int, datetime)) for x in timestamps), \
+                    'Field <timestamps> must be integer or datetime'
+
+        return self._points(metric, timestamps, columns.floats(values), tags)
+
+    def _put_point(self, metric, timestamp, value, tags=dict()):
+        """ Validates and encodes one point. <timestamp> defaults to the
+        current time. """
+        assert isinstance(metric, str), 'Field <metric> must be a string.'
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        elif isinstance(timestamp, datetime):
+            timestamp = int(time.mktime(timestamp.timetuple()))
+        else:
+            timestamp = int(timestamp)
+        return self._encode_point(metric, timestamp, float(value), tags)
+
+    def _bulk_points(self, series=None, points=None):
+        """ Validates the arguments of put_bulk and returns its encoded points.
+
+        <series> holds (metric, timestamps, values, tags) tuples, or dicts
+        with these keys. <points> holds (metric, timestamp, value, tags)
+        tuples, or dicts in the /api/put format.
+        """
+        assert series is not None or points is not None, \
+            'Field <series> or <points> is required.'
+        encoded = []
+        for s in series or ():
+            if isinstance(s, dict):
+                s = (s['metric'], s.get('timestamps', []), s['values'], s.get('tags', {}))
+            encoded.extend(self._put_points(*s))
+        for p in points or ():
+            if isinstance(p, dict):
+                p = (p['metric'], p.get('timestamp'), p['value'], p.get('tags', {}))
+            encoded.append(self._put_point(*p))
+        return encoded
+
+    def _batches(self, points, ptcl):
+        """ Splits the points in batches of <ptcl> points. """
+        assert ptcl > 0, 'Field <ptcl> must be greater than 0.'
+        return [points[i:i + ptcl] for i in range(0, len(points), ptcl)]
+
+    def _put_summary(self, points, failed, verbose=False, spooled=0):
+        success = len(points) - failed - spooled
+        if verbose and points:
+            total = len(points)
+            print("%d of %d (%.2f%%) points were successfully sent" \
+                % (success, total, 100 * round(float(success)/total, 2)))
+            if spooled:
+                print("%d points were spooled to be sent later" % spooled)
+
+        summary = {
+            'points': len(points),
+            'success': success,
+            'failed': failed
+        }
+        if spooled:
+            summary['spooled'] = spooled
+        return summary
+
+    def _split_body(self, body):
+        """ Returns the encoded points of a /api/put body. """
+        return [self._encode_point(dp['metric'], dp['timestamp'], dp['value'], dp['tags'])
+                for dp in loads(body)]
+
+    def _put_outcome(self, batch, status, text, policy):
+        """ Classifies the response of a put batch.
+
+        Returns the encoded points to send again and the number of points
+        that failed for good. <text> is the body of a 400 response, whose
+        details list the rejected points, or whose summary counts them.
+        """
+        if status is not None and 200 <= status < 300:
+            return [], 0
+
+        if status == 400 and text:
+            try:
+                details = loads(text)
+            except ValueError:
+                details = None
+            if isinstance(details, dict) and 'errors' in details:
+                retry = []
+                for e in details['errors']:
+                    dp = e.get('datapoint')
+                    if dp and policy.retry_error(e.get('error')):
+                        try:
+                            value = float(dp['value'])
+                        except (TypeError, ValueError):
+                            value = dp['value']
+                        retry.append(self._encode_point(dp['metric'],
+                            dp['timestamp'], value, dp['tags']))
+                failed = details.get('failed', len(details['errors']))
+                return retry, max(failed - len(retry), 0)
+            if isinstance(details, dict) and 'failed' in details:
+                # Summary only: the rejected points are unknown, the others
+                # were stored
+                info("HTTP error code = %s, %d points dropped" % (status, details['failed']))
+                return [], details['failed']
+
+        if policy.retry_status(status):
+            return batch, 0
+        info("HTTP error code = %s, %d points dropped" % (status, len(batch)))
+        return [], len(batch)
+
+    def _encode_point(self, metric, ts, value, tags):
+        """ Serializes one point in the /api/put JSON format. """
+        return encoder.point(encoder.prefix(metric, tags), ts, value)
+
+    def _points(self, metric, timestamps, values, tags):
+        """ Returns the encoded points of one time serie. """
+        if len(timestamps) == 0:
+            timestamps = [int(round(time.time() * 1000))] * len(values)
+        else:
+            timestamps = [int(time.mktime(t.timetuple())) if isinstance(t, datetime)
+                          else t for t in timestamps]
+        return encoder.series(encoder.prefix(metric, tags), timestamps, values)
+
+    def _put_body(self, batch):
+        """ Returns the body and headers of the /api/put request of a batch,
+        gzipped when the connection compresses. """
+        data = encoder.body(batch)
+        if not self.compress:
+            return data, self.headers
+        headers = dict(self.headers)
+        headers['Content-Encoding'] = 'gzip'
+        return encoder.compress(data, self.compress), headers
+
+    def _query_payload(self, queries, start='1h-ago', end='now', show_summary=False):
+        """ Validates the queries and builds the /api/query body. """
+        assert isinstance(queries, list), 'Field <queries> must be a list.'
+        assert len(queries) > 0, 'Field <queries> must have at least one query'
+        for q in queries:
+            assert isinstance(q, dict), 'Field <element> must be a dict.'
+            assert all(i in q.keys() for i in ['m', 'aggr', 'tags']), \
+                'Not all required elements were informed.'
+            assert isinstance(q['m'], str), \
+                'Field <metric> must be a string.'
+            assert q['aggr'] in self.aggregators, \
+                'The aggregator is not valid.'
+            assert isinstance(q['tags'], dict), \
+                'Field <tags> must be a dict'
+            if 'rate' in q.keys():
+                assert isinstance(q['rate'], bool), \
+                    'Field <rate> must be True or False'
+
+        data = {"start": start, "end": end, "queries":
+            [{
+                "aggregator": q['aggr'],
+                "metric": q['m'],
+                "tags": q['tags'],
+                "rate": q['rate'] if 'rate' in q.keys() else False,
+                'show_summary': show_summary
+            } for q in queries]
+        }
+        return data
+
+    def _query_result(self, data, nots=False, tsd=True, group=False,
+        show_summary=False, arrays=False, compact=False):
+        """ Builds the result of query from the decoded /api/query response. """
+        if arrays:
+            result = self._query_arrays(data, nots=nots, group=group)
+        elif group:
+            series = [columns.dps_lists(x['dps']) for x in data if 'metric' in x.keys()]
+            ts, vs = columns.merge_sum(series)
+            if compact:
+                result = {'results': columns.Series(None, {}, ts, vs)}
+            else:
+                result = {'results': {}}
+                if not nots:
+                    result['results']['timestamps'] = self._timestamps(ts, tsd)
+                result['results']['values'] = vs
+        else:
+            result = {'results': [self._series_result(x, nots=nots, tsd=tsd, compact=compact)
+                                  for x in data if 'metric' in x.keys()]}
+        if show_summary:
+            result['summary'] = data[-1]['statsSummary']
+        return result
+
+    def _timestamps(self, ts, tsd=True):
+        if tsd:
+            return list(map(datetime.fromtimestamp, ts))
+        return ts
+
+    def _series_result(self, x, nots=False, tsd=True, arrays=False, compact=False):
+        """ Builds the result of one series of an /api/query response. """
+        if arrays:
+            ts, vs = columns.dps_arrays(x['dps'])
+            resd = {'metric': x['metric'], 'tags': x['tags'], 'timestamps': ts, 'values': vs}
+            if nots:
+                del resd['timestamps']
+            return resd
+
+        ts, vs = columns.dps_lists(x['dps'])
+        if compact:
+            return columns.Series(x['metric'], x['tags'], ts, vs)
+        resd = {'metric': x['metric'], 'tags': x['tags']}
+        if not nots:
+            resd['timestamps'] = self._timestamps(ts, tsd)
+        resd['values'] = vs
+        return resd
+
+    def _stream_result(self, items, nots=False, tsd=True, arrays=False, batch=None):
+        """ Yields the series results of a streamed /api/query response, split
+        in pieces of at most <batch> points when <batch> is given. """
+        for x in items:
+            if not isinstance(x, dict) or 'metric' not in x.keys():
+                continue
+            resd = self._series_result(x, nots=nots, tsd=tsd, arrays=arrays)
+            if not batch or len(resd['values']) <= batch:
+                yield resd
+                continue
+            for i in range(0, len(resd['values']), batch):
+                part = dict(resd)
+                part['values'] = resd['values'][i:i + batch]
+                if not nots:
+                    part['timestamps'] = resd['timestamps'][i:i + batch]
+                yield part
+
+    def _query_arrays(self, data, nots=False, group=False):
+        """ Columnar version of the query result: timestamps and values are
+        ``int64`` and ``float64`` arrays instead of lists. """
+        series = [x for x in data if 'metric' in x.keys()]
+        if group:
+            ts, vs = columns.sum_arrays([columns.dps_arrays(x['dps']) for x in series])
+            result = {'results': {'timestamps': ts, 'values': vs}}
+            if nots:
+                del result['results']['timestamps']
+            return result
+
+        return {'results': [self._series_result(x, nots=nots, arrays=True) for x in series]}
+
+    def _query_many_plan(self, specs, pack=20):
+        """ Plans the requests of query_many.
+
+        Returns the /api/query payload of each spec, the cached results and
+        the packed payloads with, for each one, the (spec, first sub query)
+        of its parts. The specs sharing the same time window are packed
+        together, at most <pack> sub queries per payload.
+        """
+        assert isinstance(specs, list), 'Field <specs> must be a list.'
+        assert pack > 0, 'Field <pack> must be greater than 0.'
+        datas, cached, windows = [], {}, {}
+        for n, spec in enumerate(specs):
+            assert isinstance(spec, dict) and 'queries' in spec, \
+                'Field <spec> must be a dict with the queries.'
+            start, end = spec.get('start', '1h-ago'), spec.get('end', 'now')
+            data = self._query_payload(spec['queries'], start, end)
+            datas.append(data)
+            res = self._cache_get("query", data, start, end)
+            if res is not None:
+                cached[n] = res
+            else:
+                windows.setdefault((self.dumps(start), self.dumps(end)), []).append(n)
+
+        packed = []
+        for members in windows.values():
+            payload, parts = None, []
+            for n in members:
+                queries = datas[n]['queries']
+                if payload is None or len(payload['queries']) + len(queries) > pack:
+                    payload, parts = dict(datas[n], queries=[], showQuery=True), []
+                    packed.append((payload, parts))
+                parts.append((n, len(payload['queries'])))
+                payload['queries'] = payload['queries'] + queries
+        return datas, cached, packed
+
+    def _query_many_split(self, data, parts):
+        """ Splits the decoded response of a packed payload among its specs.
+        Returns the series of each spec, with the index of its own query. """
+        bounds = [offset for _, offset in parts]
+        split = {n: [] for n, _ in parts}
+        for x in data:
+            if 'metric' not in x.keys():
+                continue
+            assert 'index' in x.get('query', {}), \
+                'The series of a packed query has no query index (showQuery).'
+            index = x['query']['index']
+            part = bisect_right(bounds, index) - 1
+            n, offset = parts[part]
+            split[n].append(dict(x, query=dict(x.get('query', {}), index=index - offset)))
+        return split
+
+    def _cache_get(self, endpoint, payload, start, end):
+        """ Returns the cached response of a payload, or None. """
+        if self.cache is None:
+            return None
+        relative = timeutil.is_relative(start) or timeutil.is_relative(end)
+        return self.cache.get(self.cache.key(endpoint, payload), relative)
+
+    def _cache_put(self, endpoint, payload, start, end, value):
+        if self.cache is None:
+            return
+        relative = timeutil.is_relative(start) or timeutil.is_relative(end)
+        self.cache.put(self.cache.key(endpoint, payload), value, relative)
+
+    def _time_windows(self, start, end, chunk, align=None):
+        """ Splits the query time range in windows of <chunk> (epoch ms), cut
+        on the buckets of the downsample interval <align>, if any. """
+        now = timeutil.now_millis()
+        return timeutil.split(timeutil.to_millis(start, now),
+            timeutil.to_millis(end, now), timeutil.interval(chunk),
+            timeutil.interval(align) if align else None)
+
+    def _query_windows(self, data, start, end, chunk):
+        """ The /api/query payloads of the windows of a chunked query. """
+        assert not any(q['rate'] for q in data['queries']), \
+            'Field <chunk> can not be used with <rate>: each window would lose its first point.'
+        return [dict(data, start=s, end=e, showQuery=True)
+                for s, e in self._time_windows(start, end, chunk)]
+
+    def _merge_query(self, datas):
+        """ Stitches the /api/query responses of consecutive time windows.
+
+        The points of the same series (query, metric and tags) are merged in
+        window order, so they stay sorted and the seams have no duplicates.
+        The windows must be sent with showQuery, which gives the index of the
+        sub query of each series; the echoed query is dropped from the result.
+        The statsSummary of the windows are combined in a single one.
+        """
+        series = {}
+        summaries = []
+        for data in datas:
+            for x in data:
+                if 'metric' not in x.keys():
+                    if 'statsSummary' in x.keys():
+                        summaries.append(x['statsSummary'])
+                    continue
+                assert 'index' in x.get('query', {}), \
+                    'The series of a window has no query index (showQuery).'
+                key = (x['query']['index'], x['metric'],
+                       tuple(sorted(x['tags'].items())))
+                if key in series:
+                    series[key]['dps'].update(x['dps'])
+                else:
+                    series[key] = dict(x, dps=dict(x['dps']))
+                    del series[key]['query']
+        merged = list(series.values())
+        if summaries:
+            merged.append({'statsSummary': self._merge_summaries(summaries)})
+        return merged
+
+    def _merge_summaries(self, summaries):
+        """ Combines the statsSummary of the windows: the max* fields are the
+        largest, the avg* fields the mean and the other numbers the total. The
+        query indexes and the other fields are those of the first window. """
+        merged = {}
+        for k in summaries[0]:
+            values = [x[k] for x in summaries if k in x]
+            numbers = all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                          for v in values)
+            if not numbers or k.startswith('queryIdx'):
+                merged[k] = values[0]
+            elif k.startswith('max'):
+                merged[k] = max(values)
+            elif k.startswith('avg'):
+                merged[k] = sum(values) / float(len(values))
+            else:
+                merged[k] = sum(values)
+        return merged
+
+    def _merge_exp(self, results):
+        """ Stitches the /api/query/exp responses of consecutive time windows.
+
+        The value columns of each output are matched on their <meta> entries
+        (metrics and tags), since the series, or their order, may change from
+        one window to the next. A serie missing in a window is NaN there.
+        """
+        results = [r for r in results if r]
+        if not results:
+            return None
+        outputs = {}
+        for res in results:
+            for o in res['outputs']:
+                cur = outputs.get(o['id'])
+                if cur is None:
+                    cur = outputs[o['id']] = {'output': o, 'columns': {}, 'meta': [],
+                        'rows': {}}
+                # Position of each value column of this window in the merged output
+                where = []
+                seen = {}
+                for m in sorted(o.get('meta', []), key=lambda m: m.get('index', 0))[1:]:
+                    key = self.dumps(dict((k, v) for k, v in m.items() if k != 'index'))
+                    # Identical entries of a window are told apart by their rank
+                    seen[key] = seen.get(key, 0) + 1
+                    key = (key, seen[key])
+                    if key not in cur['columns']:
+                        cur['columns'][key] = len(cur['meta'])
+                        cur['meta'].append(m)
+                    where.append(cur['columns'][key])
+                for dp in o['dps']:
+                    if dp[0] in cur['rows']:
+                        continue
+                    if len(where) < len(dp) - 1:
+                        # No meta for these columns: keep their position
+                        where = where + list(range(len(where), len(dp) - 1))
+                    cur['rows'][dp[0]] = dict(zip(where, dp[1:]))
+
+        merged = dict(results[0])
+        merged['outputs'] = []
+        nan = float('nan')
+        for cur in outputs.values():
+            o = cur['output']
+            width = max([len(cur['meta'])] + [max(r) + 1 for r in cur['rows'].values() if r])
+            dps = [[ts] + [row.get(n, nan) for n in range(width)]
+                   for ts, row in sorted(cur['rows'].items())]
+            out = dict(o, dps=dps)
+            if 'meta' in o:
+                out['meta'] = o['meta'][:1] + [dict(m, index=n + 1)
+                    for n, m in enumerate(cur['meta'])]
+            if 'dpsMeta' in o and dps:
+                out['dpsMeta'] = dict(o['dpsMeta'], firstTimestamp=dps[0][0],
+                    lastTimestamp=dps[-1][0], setCount=len(dps), series=width)
+            merged['outputs'].append(out)
+        return merged
+
+    def gen_id(self, tid="", desc=""):
+        assert tid in self.ids.keys(), "Field <tip> is not valid."
+        assert desc, "Field <desc> is not valid."
+
+        if desc not in self.ids[tid].keys():
+            # The ids are given in sequence and never removed
+            self.ids[tid][desc] = len(self.ids[tid]) + 1
+        return "%s%d" % (tid[:1], self.ids[tid][desc])
+
+    def build_policy(self, vpol=None):
+        assert vpol != None, \
+            'Field <vpol> must have a value.'
+
+        if vpol == 0:
+            return {'policy': 'zero'}
+        elif any(isinstance(vpol, i) for i in [int, float]):
+            return {'policy': 'scalar', 'value': vpol}
+        elif vpol in ['nan', 'null']:
+            return {'policy': vpol}
+        else:
+            assert False, 'Field <vpol> is not valid.'
+
+    def build_downsampler(self, aggr='max', interval=None, vpol=None):
+        assert interval != None, \
+            'Field <interval> is not valid.'
+        assert aggr in self.aggregators, \
+            'The aggregator is not valid. Check OTSDB docs for more details.'
+
+        ret = {'interval': interval, 'aggregator': aggr}
+        if vpol:
+            ret['fillPolicy'] = self.build_policy(vpol)
+        return ret
+
+    def build_filter(self, tags={}, group=True, fid=None):
+        assert len(tags) > 0 and isinstance(tags, dict), \
+            'Field <tags> is not valid.'
+
+        obj = {"id" : fid or self.gen_id("filter", self.dumps(tags)), "tags" : []}
+        for t in tags:
+            obj["tags"].append(
+                {
+                    "type": "literal_or",
+                    "tagk": t,
+                    "filter": tags[t],
+                    "groupBy": group
+                }
+            )
+
+        return obj
+
+    def _check_metrics(self, metrics):
+        assert isinstance(metrics, list), 'Field <metrics> must be a list.'
+        assert len(metrics) > 0, 'Field <metrics> must have at least one element'
+        for m in metrics:
+            assert isinstance(m, dict), 'Field <element> must be a dict.'
+            assert all(i in m.keys() for i in ['m', 'tags']), \
+                'Not all required element keys were informed.'
+            assert isinstance(m['m'], str), \
+                'Field <metric> must be a string.'
+            assert isinstance(m['tags'], dict), \
+                'Field <tags> must be a dict'
+
+    def _compile_exp(self, metrics, exprs, vpol):
+        """ Builds the metrics, filters, expressions and outputs of an
+        /api/query/exp body, cached per (metrics, exprs, vpol).
+
+        The ids are scoped to the query: the metrics are m1, m2, ... and the
+        filters f1, f2, ... in order of appearance. The returned dict is
+        shared by the calls and must not be changed.
+        """
+        descs = [self.dumps(m) for m in metrics]
+        key = (tuple(descs), tuple(map(tuple, exprs)), repr(vpol))
+        plan = _exp_plans.get(key)
+        if plan is not None:
+            return plan
+
+        self._check_metrics(metrics)
+        assert isinstance(exprs, list), 'Field <exprs> must be a list.'
+        assert len(exprs) > 0, 'Field <exprs> must have at least one metric'
+        for e in exprs:
+            assert len(e) == 2, \
+                'Tuple must have the (id, expr) format.'
+            assert isinstance(e[0], str), \
+                'Field <id> must be a string.'
+            assert isinstance(e[1], str), \
+                'Field <expr> must be a string.'
+
+        # Setting <filters> and <metric> definitions, one filter per tag set
+        filters = {}
+        metric_ids = {}
+        q_metrics = []
+        for m, desc in zip(metrics, descs):
+            tags = self.dumps(m['tags'])
+            if tags not in filters:
+                filters[tags] = self.build_filter(tags=m['tags'],
+                    fid='f%d' % (len(filters) + 1))
+            if desc in metric_ids:
+                continue
+            metric_ids[desc] = 'm%d' % (len(metric_ids) + 1)
+            obj = {
+                'id': metric_ids[desc],
+                'filter': filters[tags]['id'],
+                'metric': m['m']
+            }
+            if vpol is not None:
+                obj['fillPolicy'] = self.build_policy(vpol)
+            q_metrics.append(obj)
+
+        # Setting <expression> definitions, longest references first so that
+        # no reference is replaced inside another one
+        refs = sorted(metric_ids.items(), key=lambda i: -len(i[0]))
+        q_exprs = []
+        for e in exprs:
+            expr = e[1]
+            for desc, mid in refs:
+                if desc in expr:
+                    expr = expr.replace(desc, mid)
+            q_exprs.append({'id': e[0], 'expr': expr})
+
+        outputs = [
+            {
+                'id': e[0],
+                'alias': 'Expression %s' % e[0]
+            } for e in exprs]
+
+        plan = {
+           'metrics': q_metrics,
+           'filters': list(filters.values()),
+           'expressions': q_exprs,
+           'outputs': outputs
+        }
+        if len(_exp_plans) >= _MAX_EXP_PLANS:
+            _exp_plans.clear()
+        _exp_plans[key] = plan
+        return plan
+
+    def _query_exp_payload(self, aggr='sum', start='1d-ago', end='now', vpol="nan",
+        metrics=[], exprs=[], dsampler=None):
+        """ Validates the arguments of query_expressions and builds the /api/query/exp body. """
+        assert aggr in self.aggregators, \
+            'The aggregator is not valid. Check OTSDB docs for more details.'
+
+        assert any(isinstance(vpol, i) for i in [int, float]) or \
+                (isinstance(vpol, str) and vpol in ['null', 'nan']), \
+            'Field <vpol> is not valid.'
+
+        if dsampler:
+            assert 2 <= len(dsampler) <= 3, \
+                'Field <dsampler> must be composed by (interval, aggr) ' \
+                'or (interval, aggr, vpol).'
+            assert isinstance(dsampler[0], str), \
+                'Field <interval> must be a string.'
+            assert dsampler[1] in self.aggregators, \
+                'Field <aggr> is not a valid aggregator.'
+        # Setting <time> definitions
+        qtime = {
+            'start': start,
+            'aggregator': aggr,
+            'end': end
+        }
+        if dsampler:
+            qtime['downsampler'] = self.build_downsampler(
+                interval=dsampler[0], aggr=dsampler[1],
+                vpol=dsampler[2] if len(dsampler) == 3 else None)
+
+        # Building the data query
+        return dict(self._compile_exp(metrics, exprs, vpol), time=qtime)
+
+    def _aggregate_outputs(self, res):
+        """ Sums the series of each output in a single one (forceAggregate).
+
+        Returns a new result sharing nothing mutable with <res>, which is not
+        changed (it may be cached).
+        """
+        res = dict(res)
+        if 'query' in res:
+            res['query'] = deepcopy(res['query'])
+        res["outputs"] = [dict(o) for o in res["outputs"]]
+        for i in range(len(res["outputs"])):
+            # Forcing the aggregation
+            dps = res["outputs"][i]["dps"]
+            new_dps = []
+            for dp in dps:
+                if len(dp) >= 2:
+                    new_dps.append([dp[0], sum(dp[1:])])
+            res["outputs"][i]["dps"] = new_dps
+            res["outputs"][i]["dpsMeta"] = dict(res["outputs"][i]["dpsMeta"], series=1)
+            res["outputs"][i]["meta"] = []
+        return res
+
+    def _exp_result(self, res, forceAggregate=False):
+        """ The result returned by query_expressions. It is never the object
+        kept in the cache, which the caller could change. """
+        if not res:
+            return res
+        if forceAggregate:
+            return self._aggregate_outputs(res)
+        return deepcopy(res) if self.cache is not None else res
+
+    def _summing_parts(self, metrics, split=100):
+        """ Splits the metrics of query_summing in groups of at most <split>
+        metrics. Returns the (metrics, exprs) of each group. """
+        self._check_metrics(metrics)
+        assert split is None or split > 0, 'Field <split> must be greater than 0.'
+        split = split or len(metrics)
+        parts = []
+        for n in range(0, len(metrics), split):
+            group = metrics[n:n + split]
+            parts.append((group, [("sum", " + ".join(self.dumps(m) for m in group))]))
+        return parts
+
+    def _combine_sums(self, results, sizes, vpol):
+        """ Adds the partial sums of the groups of query_summing, each already
+        aggregated in one serie. A timestamp missing in a group counts as its
+        metrics filled with <vpol>. """
+        results = [self._aggregate_outputs(r) for r in results]
+        points = []
+        for res in results:
+            dps = res['outputs'][0]['dps'] if res['outputs'] else []
+            points.append(dict((dp[0], dp[1]) for dp in dps))
+        nan = float('nan')
+        combined = []
+        for ts in sorted(set().union(*points)):
+            total = 0.0
+            for dps, size in zip(points, sizes):
+                v = dps.get(ts)
+                if v is None:
+                    v = vpol * size if isinstance(vpol, (int, float)) else nan
+                total += v
+            combined.append([ts, total])
+
+        merged = dict(results[0])
+        output = dict(merged['outputs'][0], dps=combined, meta=[]) \
+            if merged['outputs'] else {'id': 'sum', 'dps': combined, 'meta': []}
+        if 'dpsMeta' in output and combined:
+            output['dpsMeta'] = dict(output['dpsMeta'], firstTimestamp=combined[0][0],
+                lastTimestamp=combined[-1][0], setCount=len(combined), series=1)
+        merged['outputs'] = [output]
+        return merged
+
+    def dumps(self, x):
+        return tdumps(x, default=str)
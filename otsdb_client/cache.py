@@ -0,0 +1,104 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+from collections import OrderedDict
+
+from json import dumps
+
+
+class QueryCache(object):
+    """ LRU cache of query responses with TTL-based expiration.
+
+    The entries are keyed on the normalized request payload. Queries whose
+    time range is anchored on the current time ('now', '1h-ago') use
+    <relative_ttl>; with the default of 0 they bypass the cache.
+
+    Parameters
+    ----------
+    'maxsize' : int, optional (default=256)
+        Maximum number of cached responses.
+
+    'ttl' : float, optional (default=300)
+        Seconds a response of an absolute time range stays valid.
+
+    'relative_ttl' : float, optional (default=0)
+        Seconds a response of a relative time range stays valid.
+    """
+
+    def __init__(self, maxsize=256, ttl=300, relative_ttl=0):
+        assert maxsize > 0, 'Field <maxsize> must be greater than 0.'
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.relative_ttl = relative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def key(self, endpoint, payload):
+        return endpoint + ':' + dumps(payload, sort_keys=True, default=str)
+
+    def _ttl(self, relative):
+        return self.relative_ttl if relative else self.ttl
+
+    def get(self, key, relative=False):
+        """ Returns the cached value of <key>, or None. """
+        with self._lock:
+            if self._ttl(relative) <= 0:
+                self.bypasses += 1
+                return None
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, relative=False):
+        ttl = self._ttl(relative)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ Counters of hits, misses, bypasses and evictions. """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions
+            }
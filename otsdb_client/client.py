@@ -15,19 +15,31 @@
 
 import grequests as gr
 import time
-import itertools
-from datetime import datetime
+import threading
 import socket
-
-from json import dumps as tdumps, loads
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from otsdb_client.base import BaseConnection
+from otsdb_client.cache import QueryCache
+from otsdb_client.metadata import SHARED
+from otsdb_client.metrics import Metrics
+from otsdb_client.ratelimit import RateLimiter
+from otsdb_client.retry import RetryPolicy
+from otsdb_client.spool import Spool
+from otsdb_client.stream import iter_array
+from otsdb_client.suggest import SuggestIndex
+from otsdb_client.telnet import TelnetTransport
+
+from json import loads
 from logging import info
 from logging import getLogger,CRITICAL
 getLogger("requests").setLevel(CRITICAL)
 getLogger("grequests").setLevel(CRITICAL)
 
-def ping(host, port):
+def ping(host, port, timeout=5):
     try:
-        socket.socket().connect((host, port))
+        socket.create_connection((host, port), timeout).close()
         info('Ping in '+host+':'+str(port) + " OpenTSDB Server: Ok")
         return True
     except socket.error as err:
@@ -36,63 +48,270 @@ def ping(host, port):
         raise Exception('Fail to test OpenTSDB connection status')
 
 def exception_handler(request, exception):
-    pass # suppress errors on grequests.map
+    # grequests.map leaves the response as None, the callers handle it
+    info('Request to %s failed: %s' % (request.url, exception))
+
+class TimedRequest(gr.AsyncRequest):
+    """ A request recording its latency and sizes in the metrics of the
+    connection. """
+
+    def __init__(self, conn, endpoint, method, url, **kwargs):
+        super(TimedRequest, self).__init__(method, url, **kwargs)
+        self.conn = conn
+        self.endpoint = endpoint
+
+    def send(self, **kwargs):
+        started = time.time()
+        super(TimedRequest, self).send(**kwargs)
+        elapsed = time.time() - started
+        r = self.response
+        data = self.kwargs.get('data')
+        received = 0
+        if r is not None:
+            length = r.headers.get('Content-Length')
+            if length is not None:
+                received = int(length)
+            elif not kwargs.get('stream', self.kwargs.get('stream')):
+                received = len(r.content)
+        self.conn.metrics.request(self.endpoint, r.status_code if r is not None else None,
+            len(data) if data else 0, received, elapsed)
+        return self
+
+class Connection(BaseConnection):
+    def __init__(self, server='localhost', port=4242, pool_connections=10,
+        pool_maxsize=10, keep_alive=True, timeout=None, cache=None, retry=None,
+        spool=None, compress=False, transport='http', metrics=None, metadata=None,
+        index=None, ratelimit=None):
+        """ Connection with an OpenTSDB server.
+
+        Parameters
+        ----------
+        'server' : string, optional (default=localhost)
+            The IP address or URI of the server.
+
+        'port' : int, optional (default=4242)
+            The port that TSD is running.
+
+        'pool_connections' : int, optional (default=10)
+            Number of host pools kept by each HTTP session.
+
+        'pool_maxsize' : int, optional (default=10)
+            Maximum number of connections kept open per host.
+
+        'keep_alive' : boolean, optional (default=True)
+            Reuse the HTTP connections between requests.
+
+        'timeout' : float or tuple, optional (default=None)
+            The (connect, read) timeout in seconds of every HTTP request.
+
+        'cache' : QueryCache or boolean, optional (default=None)
+            Caches the responses of query and query_expressions. True uses a
+            :class:`otsdb_client.cache.QueryCache` with the default settings.
+
+        'retry' : RetryPolicy, optional (default=None)
+            The :class:`otsdb_client.retry.RetryPolicy` of put. By default put
+            makes <att> attempts with exponential backoff.
 
-class Connection(object):
-    def __init__(self, server='localhost', port=4242):
+        'spool' : Spool or string, optional (default=None)
+            A :class:`otsdb_client.spool.Spool` (or its directory) keeping on
+            disk the points put could not store, replayed in background when
+            the TSD is back.
+
+        'compress' : boolean or int, optional (default=False)
+            Gzips the bodies of put. An int sets the compression level (1-9),
+            True uses level 1.
+
+        'transport' : string or TelnetTransport, optional (default=http)
+            The transport of put: 'http' (/api/put) or 'telnet', which writes
+            the points as telnet-style lines on long-lived TCP connections. A
+            :class:`otsdb_client.telnet.TelnetTransport` sets its options.
+
+        'metrics' : Metrics, optional (default=None)
+            The :class:`otsdb_client.metrics.Metrics` registry recording the
+            requests, retries and points of this connection. By default each
+            connection has its own, in <metrics>.
+
+        'metadata' : MetadataCache, optional (default=None)
+            Caches the aggregators, filters and version of the server. By
+            default the cache is shared by the connections of the process.
+
+        'index' : SuggestIndex or boolean, optional (default=None)
+            Answers suggest from a :class:`otsdb_client.suggest.SuggestIndex`
+            of the names, loaded on the first call and refreshed in background.
+            True uses an index with the default settings.
+
+        'ratelimit' : RateLimiter or boolean, optional (default=None)
+            Paces the /api/put requests with a
+            :class:`otsdb_client.ratelimit.RateLimiter`: points and requests
+            per second and adaptive concurrency. True adapts the concurrency
+            only. By default put sends at most <pool_maxsize> requests at once.
+
+        The connection is lazy: the server is pinged and its aggregators are
+        fetched on first use, and only once per refresh interval of the
+        metadata cache.
+        """
+        assert compress is True or compress is False or 0 <= compress <= 9, \
+            'Field <compress> must be a boolean or a level between 0 and 9.'
+        assert transport in ('http', 'telnet') or isinstance(transport, TelnetTransport), \
+            'Field <transport> must be http, telnet or a TelnetTransport.'
         self.server = server
         self.port = port
-        ping(server, port)
         self.url = 'http://%s:%d' % (server, port)
         self.headers = {'content-type': "application/json"}
-        self.aggregators = self.get_aggregators()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.cache = QueryCache() if cache is True else (cache or None)
+        self.retry = retry
+        self.compress = 1 if compress is True else int(compress)
+        self.spool = Spool(spool) if isinstance(spool, str) else spool
+        self.metrics = metrics or Metrics()
+        self.metadata = metadata or SHARED
+        self.index = SuggestIndex() if index is True else (index or None)
+        self.ratelimit = RateLimiter() if ratelimit is True else (ratelimit or None)
+        if self.ratelimit is not None:
+            self.metrics.gauge('put.concurrency', lambda: self.ratelimit.limit)
+        self._aggregators = None
+        if transport == 'http':
+            self.transport = None
+        elif transport == 'telnet':
+            self.transport = TelnetTransport(server, port)
+        else:
+            self.transport = transport
+        # One pooled session per thread: the greenlets of a thread share it
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._writer = None
         self.ids = {"filter": {}, "metric": {}}
-
-    def get_endpoint(self, key=""):
-        endpoint = '/api' + {
-            'filters': '/config/filters',
-            'query_exp': '/query/exp',
-            'aggr': '/aggregators',
-            'suggest': '/suggest',
-            'version': '/version',
-            'put': '/put?details',
-            'query': '/query',
-            'stats': '/stats',
-        }.get(str(key))
-
-        assert endpoint is not '/api', \
-            "Please provide a valid endpoint."
-        return endpoint
+        if self.spool is not None:
+            self.spool.start(self)
+
+    def ping(self):
+        """ Checks that the TSD accepts connections. Raises an exception otherwise. """
+        return ping(self.server, self.port)
+
+    def _check_server(self):
+        """ Pings the server on first use, once per refresh interval of the
+        metadata cache. """
+        self.metadata.fetch(self.url, 'ping', self.ping)
+
+    @property
+    def aggregators(self):
+        """ The aggregation functions of the server, fetched on first use. """
+        if self._aggregators is not None:
+            return self._aggregators
+        return self.metadata.fetch(self.url, 'aggregators', self.get_aggregators)
+
+    @aggregators.setter
+    def aggregators(self, value):
+        self._aggregators = value
+
+    def _session(self):
+        """ Returns the pooled HTTP session of the current thread. """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _request(self, method, endpoint="", query='', **kwargs):
+        """ Builds an async request to an endpoint using the pooled session. """
+        kwargs.setdefault('timeout', self.timeout)
+        if endpoint != 'put':
+            self._check_server()
+        return TimedRequest(self, endpoint, method,
+            self.url + self.get_endpoint(endpoint) + query,
+            session=self._session(), **kwargs)
 
     def _get(self, endpoint="", params=dict()):
-        r = gr.get(self.url + self.get_endpoint(endpoint),
-                   params=params)
+        r = self._request('GET', endpoint, params=params)
         gr.map([r],exception_handler=exception_handler)
         return r.response
 
     def _post(self, endpoint="", data=dict()):
         assert isinstance(data, dict), 'Field <data> must be a dict.'
 
-        r = gr.post(self.url + self.get_endpoint(endpoint),
-            data=self.dumps(data), headers=self.headers)
+        r = self._request('POST', endpoint, data=self.dumps(data),
+            headers=self.headers)
         gr.map([r],exception_handler=exception_handler)
 
         return r.response
 
-    def process_response(self, response):
-        status = response.status_code
+    def _post_many(self, endpoint, payloads, concurrency=4, att=3, partial=False):
+        """ Posts the payloads concurrently, at most <concurrency> at a time.
 
-        if not (200 <= status < 300):
-            info("HTTP error code = %d" % status)
-            return False
+        Failed requests are sent again up to <att> attempts, except on client
+        errors (4xx). Returns the responses in the order of <payloads>, or
+        None when some payload could not be sent. With <partial>, the
+        responses of the payloads that could not be sent are None instead, or
+        False when they were rejected (4xx).
+        """
+        resps = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+        attempts = 0
+        while pending and attempts < att:
+            reqs = [self._request('POST', endpoint, data=self.dumps(payloads[i]),
+                headers=self.headers) for i in pending]
+            gr.map(reqs, size=concurrency, exception_handler=exception_handler)
+
+            failed = []
+            for i, r in zip(pending, reqs):
+                if r.response is not None and 200 <= r.response.status_code < 300:
+                    resps[i] = r.response
+                elif r.response is not None and r.response.status_code < 500:
+                    info("HTTP error code = %d" % r.response.status_code)
+                    if not partial:
+                        return None
+                    resps[i] = False
+                else:
+                    failed.append(i)
+            pending = failed
+            attempts += 1
+
+        return None if pending and not partial else resps
 
-        data = loads(response.text)
-        return data if data else None
+    def pool_stats(self):
+        """ Returns the usage of the HTTP connection pools.
+
+        'sessions' is the number of pooled sessions (one per thread), 'pools'
+        the number of host pools, 'connections' the number of connections
+        opened so far and 'requests' the number of requests they served.
+        """
+        stats = {'sessions': 0, 'pools': 0, 'connections': 0, 'requests': 0,
+            'maxsize': self.pool_maxsize}
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            stats['sessions'] += 1
+            manager = session.get_adapter(self.url).poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                stats['pools'] += 1
+                stats['connections'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+        return stats
+
+    def process_response(self, response):
+        if response is None:
+            return False
+        return self._process(response.status_code, response.text)
 
     def filters(self):
-        """ Lists the various filters loaded by the TSD """
-        resp = self._get(endpoint="filters")
-        return self.process_response(resp)
+        """ Lists the various filters loaded by the TSD (cached) """
+        return self.metadata.fetch(self.url, 'filters',
+            lambda: self.process_response(self._get(endpoint="filters")))
 
     def statistics(self):
         """Get info about what metrics are registered and with what stats."""
@@ -105,9 +324,9 @@ class Connection(object):
         return self.process_response(resp)
 
     def version(self):
-        """Used to check OpenTSDB version. """
-        resp = self._get(endpoint="version")
-        return self.process_response(resp)
+        """Used to check OpenTSDB version (cached). """
+        return self.metadata.fetch(self.url, 'version',
+            lambda: self.process_response(self._get(endpoint="version")))
 
     def suggest(self, type='metrics', q='', max=9999):
         """ Matches the string in the query on the first chars of the stored data.
@@ -123,8 +342,19 @@ class Connection(object):
         'max' : int, optional (default=9999)
             The maximum number of suggested results. Must be greater than 0.
 
+        With an <index>, the names come from the local index when it is
+        complete for the type.
         """
-        resp = self._get(endpoint="suggest", params={'type': type, 'q': q, 'max': max})
+        if self.index is not None:
+            self.index.open(self._suggest_names)
+            found = self.index.lookup(type, q, max)
+            if found is not None:
+                return found
+        resp = self._get(endpoint="suggest", params=self._suggest_params(type, q, max))
+        return self.process_response(resp)
+
+    def _suggest_names(self, type, limit):
+        resp = self._get(endpoint="suggest", params=self._suggest_params(type, '', limit))
         return self.process_response(resp)
 
     def put(self, metric=None, timestamps=[], values=[], tags=dict(),
@@ -136,17 +366,19 @@ class Connection(object):
         'metric' : string, required (default=None)
             The name of the metric you are storing.
 
-        'timestamps' : int, required (default=None) ** [generated over mktime]
-            A Unix epoch style timestamp in seconds or milliseconds.
+        'timestamps' : array, required (default=None) ** [generated over mktime]
+            Unix epoch style timestamps in seconds or milliseconds. A list or a
+            NumPy/buffer array of integers (or datetime64).
 
         'values' : array, required (default=[])
-            The values to record.
+            The values to record. A list or a NumPy/buffer array.
 
         'tags' : map, required (default=dict())
             A map of tag name/tag value pairs.
 
         'details' : boolean, optional (default=True)
-            Whether or not to return detailed information
+            Ask the TSD for the details of the failed points, so only those
+            points are sent again
 
         'verbose' : boolean, optional (default=False)
             Enable verbose output.
@@ -155,77 +387,211 @@ class Connection(object):
             Number of points sent per http request
 
         'att' : int, required (default=5)
-            Number of HTTP request attempts
+            Number of HTTP request attempts, when the connection has no retry policy
         """
-        assert isinstance(metric, str), 'Field <metric> must be a string.'
-        assert isinstance(values, list), 'Field <values> must be a list.'
-        assert isinstance(timestamps, list), 'Field <timestamps> must be a list.'
-
-        if len(timestamps) > 0:
-            assert len(timestamps) == len(values), \
-                'Field <timestamps> dont fit field <values>.'
-            assert all(isinstance(x, (int, datetime)) for x in timestamps), \
-                'Field <timestamps> must be integer or datetime'
-
-        pts = list()
-        ptl = []
-        ptc = 0
-
-        for n, v in enumerate(values):
-            v = float(v)
-
-            if not timestamps:
-                current_milli_time = lambda: int(round(time.time() * 1000))
-                nts = current_milli_time()
-            else:
-                nts = timestamps[n]
+        points = self._put_points(metric, timestamps, values, tags)
+        batches = self._batches(points, ptcl)
+        failed, spooled = self._put_batches(batches, att=att, verbose=verbose,
+            details=details, concurrency=self.pool_maxsize)
+        return self._put_summary(points, failed, verbose, spooled)
 
-                if isinstance(nts, datetime):
-                    nts = int(time.mktime(nts.timetuple()))
-                elif not isinstance(nts, int):
-                    nts = int(nts)
+    def put_bulk(self, series=None, points=None, details=True, verbose=False,
+        ptcl=50, concurrency=None, att=5):
+        """ Put the points of many time series into OpenTSDB over HTTP.
 
-            u = {'timestamp': nts, 'metric': metric, 'value': v, 'tags': tags}
+        The points of all the series are packed in full batches of <ptcl>
+        points, whatever the serie they belong to, and the batches are sent
+        concurrently.
 
-            ptl.append(u)
-            ptc += 1
+        Parameters
+        ----------
+        'series' : iterable, optional (default=None)
+            (metric, timestamps, values, tags) tuples, or dicts with these keys,
+            in the format of :meth:`put`.
 
-            if ptc == ptcl:
-                ptc = 0
-                pts.append(gr.post(self.url + self.get_endpoint("put") +
-                '?summary=true&details=true', data=self.dumps(ptl)))
-                ptl = list()
+        'points' : iterable, optional (default=None)
+            (metric, timestamp, value, tags) tuples, or dicts in the /api/put
+            format. A missing timestamp is the current time.
 
-        if ptl:
-            pts.append(gr.post(self.url + self.get_endpoint("put") +
-                '?summary=true&details=true', data=self.dumps(ptl)))
+        'details' : boolean, optional (default=True)
+            Ask the TSD for the details of the failed points, so only those
+            points are sent again
 
-        attempts = 0
-        fails = 1
-        while attempts < att and fails > 0:
-            gr.map(pts,exception_handler=exception_handler)
+        'verbose' : boolean, optional (default=False)
+            Enable verbose output.
 
-            if verbose:
-                print('Attempt %d: Request submitted with HTTP status codes %s' \
-                    % (attempts + 1, str([x.response.status_code for x in pts])))
+        'ptcl' : int, optional (default=50)
+            Number of points sent per http request
 
-            pts = [x for x in pts if not 200 <= x.response.status_code <= 300]
-            attempts += 1
-            fails = len([x for x in pts])
+        'concurrency' : int, optional (default=pool_maxsize)
+            Maximum number of requests in flight.
 
-        if verbose:
-            total = len(values)
-            print("%d of %d (%.2f%%) requests were successfully sent" \
-                % (total - fails, total, 100 * round(float((total - fails))/total, 2)))
+        'att' : int, optional (default=5)
+            Number of HTTP request attempts, when the connection has no retry policy
 
-        return {
-            'points': len(values),
-            'success': len(values) - fails,
-            'failed': fails
-        }
+        Example
+        -------
+        >>> c.put_bulk(series=[('sys.cpu', [1451606400, 1451606460], [0.5, 0.7], {'host': 'a'}),
+        ...                    ('sys.cpu', [1451606400], [0.2], {'host': 'b'})])
+        """
+        points = self._bulk_points(series, points)
+        batches = self._batches(points, ptcl)
+        failed, spooled = self._put_batches(batches, att=att, verbose=verbose,
+            details=details, concurrency=concurrency or self.pool_maxsize)
+        return self._put_summary(points, failed, verbose, spooled)
+
+    def _put_batches(self, batches, att=5, verbose=False, details=True, spool=True,
+        concurrency=None, keep=None):
+        """ Sends batches of encoded points to /api/put.
+
+        The failed batches, or only their failed points when <details> is
+        True, are sent again following the retry policy of the connection
+        (by default <att> attempts with exponential backoff). The points still
+        failing after the last attempt go to the spool of the connection, if
+        any and <spool> is True. With the telnet transport, the batches are
+        written on its connections instead. The points sent again are packed in full
+        batches. At most <concurrency> requests are in flight (all of them by
+        default), paced by the rate limiter of the connection, if any.
+
+        When <keep> is a list, the batches still failing after the last
+        attempt are appended to it instead, and are not counted as failed:
+        only the points rejected for good are.
+
+        Returns the number of points that could not be stored and the number
+        of points spooled.
+        """
+        policy = self.retry or RetryPolicy(attempts=att)
+        if self.transport is not None:
+            pending, failed = self.transport.send(batches, policy, verbose), 0
+        else:
+            pending, failed = self._http_put(batches, policy, verbose, details,
+                concurrency)
+
+        spooled = kept = 0
+        for b in pending:
+            if keep is not None:
+                keep.append(b)
+                kept += len(b)
+            elif spool and self.spool is not None:
+                self.spool.append(b)
+                spooled += len(b)
+            else:
+                failed += len(b)
+        total = sum(map(len, batches))
+        self.metrics.incr('put.points', total - failed - spooled - kept)
+        if failed:
+            self.metrics.incr('put.failed', failed)
+        if spooled:
+            self.metrics.incr('put.spooled', spooled)
+        return failed, spooled
+
+    def _http_put(self, batches, policy, verbose=False, details=True, concurrency=None):
+        """ Sends the batches to /api/put. Returns the batches still failing
+        after the last attempt and the number of points that failed for good. """
+        query = '?details=true' if details else '?summary=true'
+
+        def request(batch):
+            data, headers = self._put_body(batch)
+            return self._request('POST', "put", query, data=data, headers=headers)
+
+        pending = [b for b in batches if b]
+        size = max(map(len, pending)) if pending else 1
+        failed = 0
+        attempt = 0
+        while pending:
+            reqs = self._send_puts(pending, request, concurrency)
+            attempt += 1
+
+            if verbose:
+                print('Attempt %d: Request submitted with HTTP status codes %s' \
+                    % (attempt, str([r.response.status_code if r.response is not None
+                        else None for r in reqs])))
+
+            retry = []
+            for b, r in zip(pending, reqs):
+                status = r.response.status_code if r.response is not None else None
+                points, lost = self._put_outcome(b, status,
+                    r.response.text if status == 400 else None, policy)
+                failed += lost
+                if points:
+                    retry.append(points)
+            pending = self._batches([p for b in retry for p in b], size)
+
+            if pending and attempt >= policy.attempts:
+                break
+            if pending:
+                self.metrics.incr('put.retries', sum(map(len, pending)))
+                time.sleep(policy.delay(attempt))
+        return pending, failed
+
+    def _send_puts(self, batches, request, concurrency=None):
+        """ Sends the requests built by request(batch), at most <concurrency>
+        at a time. With a rate limiter, each request is built and sent when
+        the limiter lets it go, and the concurrency of the limiter, if any,
+        replaces <concurrency>. Returns the requests in the order of <batches>. """
+        if self.ratelimit is None:
+            reqs = [request(b) for b in batches]
+            gr.map(reqs, size=concurrency, exception_handler=exception_handler)
+            return reqs
+
+        limiter = self.ratelimit
+        reqs = [None] * len(batches)
+
+        def send(r, ticket):
+            started = time.time()
+            r.send()
+            if r.response is None:
+                exception_handler(r, r.exception)
+            limiter.release(ticket, r.response.status_code if r.response is not None
+                else None, time.time() - started)
+
+        pool = gr.Pool(concurrency) if concurrency and limiter.limit is None else gr.Pool()
+        for n, b in enumerate(batches):
+            ticket = limiter.wait(len(b))
+            reqs[n] = request(b)
+            pool.spawn(send, reqs[n], ticket)
+        pool.join()
+        return reqs
+
+    def writer(self, **kwargs):
+        """ Returns the background writer of this connection, creating it on first use.
+
+        The keyword arguments are passed to :class:`otsdb_client.writer.Writer`
+        and are only considered when the writer is created.
+        """
+        if self._writer is None or self._writer.closed:
+            from otsdb_client.writer import Writer
+            self._writer = Writer(self, **kwargs)
+            self.metrics.gauge('writer.queue', self._writer.qsize)
+        return self._writer
+
+    def tail(self, queries=[], window='1h-ago', size=3600):
+        """ Returns a :class:`otsdb_client.tail.Tail` that follows the queries,
+        fetching only the points added since its last refresh. """
+        from otsdb_client.tail import Tail
+        return Tail(self, queries, window=window, size=size)
+
+    def close(self):
+        """ Flushes and stops the background writer, if any, and closes the
+        pooled HTTP connections. """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.spool is not None:
+            self.spool.stop()
+        if self.transport is not None:
+            self.transport.close()
+        if self.index is not None:
+            self.index.stop()
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._local = threading.local()
 
     def query(self, queries=[], start='1h-ago', end='now', show_summary=False,
-        show_json=False, nots=False, tsd=True, group=False):
+        show_json=False, nots=False, tsd=True, group=False, arrays=False,
+        chunk=None, concurrency=4, att=3, compact=False):
         """ Enables extracting data from the storage system
 
         Parameters
@@ -259,137 +625,153 @@ class Connection(object):
 
         'group': boolean, optional (default=False)
             Returns the points of the time series grouped (i.e. metric + tags) in one list
+
+        'arrays': boolean, optional (default=False)
+            Returns the timestamps (integers) and values of each serie as int64 and
+            float64 arrays (NumPy arrays when available, else ``array.array``).
+
+        'chunk' : string or int, optional (default=None)
+            Splits the [start, end] range in windows of this interval (e.g. '7d',
+            or seconds) queried concurrently and stitched back together. Not
+            available for the queries with <rate>.
+
+        'concurrency' : int, optional (default=4)
+            Maximum number of windows queried at a time.
+
+        'att' : int, optional (default=3)
+            Number of HTTP request attempts of each window.
+
+        'compact' : boolean, optional (default=False)
+            Returns each serie as a :class:`otsdb_client.columns.Series`, with
+            integer timestamps and float values in ``array.array`` buffers.
         """
-        assert isinstance(queries, list), 'Field <queries> must be a list.'
-        assert len(queries) > 0, 'Field <queries> must have at least one query'
-        for q in queries:
-            assert isinstance(q, dict), 'Field <element> must be a dict.'
-            assert all(i in q.keys() for i in ['m', 'aggr', 'tags']), \
-                'Not all required elements were informed.'
-            assert isinstance(q['m'], str), \
-                'Field <metric> must be a string.'
-            assert q['aggr'] in self.aggregators, \
-                'The aggregator is not valid.'
-            assert isinstance(q['tags'], dict), \
-                'Field <tags> must be a dict'
-            if 'rate' in q.keys():
-                assert isinstance(q['rate'], bool), \
-                    'Field <rate> must be True or False'
-
-        data = {"start": start, "end": end, "queries":
-            [{
-                "aggregator": q['aggr'],
-                "metric": q['m'],
-                "tags": q['tags'],
-                "rate": q['rate'] if 'rate' in q.keys() else False,
-                'show_summary': show_summary
-            } for q in queries]
-        }
-
-        resp = self._post(endpoint="query", data=data)
-
-        if 200 <= resp.status_code <= 300:
-            result = None
-            if show_json:
-                # Raw response
-                result = resp.text
+        data = self._query_payload(queries, start, end, show_summary)
+        res = self._cache_get("query", data, start, end)
+        if res is None:
+            if chunk:
+                payloads = self._query_windows(data, start, end, chunk)
+                resps = self._post_many("query", payloads, concurrency, att)
+                if resps is not None:
+                    res = self._merge_query([loads(r.text) for r in resps])
             else:
-                data = loads(resp.text)
-                if group:
-                    dpss = dict()
-                    for x in data:
-                        if 'metric' in x.keys():
-                            for k,v in x['dps'].items():
-                                if k in dpss.keys():
-                                    dpss[k] += v
-                                else:
-                                    dpss[k] = v
-                    points = sorted(dpss.items())
-                    if not nots:
-                        result = {'results':{'timestamps':[],'values':[]}}
-                        if tsd:
-                            result['results']['timestamps'] = [datetime.fromtimestamp(float(x[0])) for x in points]
-                        else:
-                            result['results']['timestamps'] = [x[0] for x in points]
-                    else:
-                        result = {'results':{'values':[]}}
-                    result['results']['values'] = [float(x[1]) for x in points]
-                else:
-                    result = {'results':[]}
-                    for x in data:
-                        if 'metric' in x.keys():
-                            dps = x['dps']
-                            points = sorted(dps.items())
-                            resd = {'metric':x['metric'],'tags':x['tags'],'timestamps':[],'values':[float(y[1]) for y in points]}
-                            if not nots:
-                                if tsd:
-                                    resd['timestamps'] = [datetime.fromtimestamp(float(x[0])) for x in points]
-                                else:
-                                    resd['timestamps'] = [x[0] for x in points]
-                            else:
-                                del resd['timestamps']
-                            result['results'].append(resd)
-                if show_summary:
-                    result['summary'] = data[-1]['statsSummary']
-            return result
-        else:
-            print('No results found')
-            return []
+                resp = self._post(endpoint="query", data=data)
+                if resp is not None and 200 <= resp.status_code <= 300:
+                    if show_json and self.cache is None:
+                        # Raw response
+                        return resp.text
+                    res = loads(resp.text)
+
+            if res is None:
+                print('No results found')
+                return []
+            self._cache_put("query", data, start, end, res)
+
+        if show_json:
+            return self.dumps(res)
+        return self._query_result(res, nots=nots, tsd=tsd, group=group,
+            show_summary=show_summary, arrays=arrays, compact=compact)
+
+    def query_many(self, specs=[], nots=False, tsd=True, arrays=False, pack=20,
+        concurrency=4, att=3, compact=False):
+        """ Runs many independent queries, e.g. the panels of a dashboard.
+
+        The specs sharing the same time window are packed in a single
+        /api/query request (at most <pack> sub queries each) and the requests
+        are sent concurrently. A request rejected by the TSD (4xx, e.g. one
+        unknown metric) is sent again one spec at a time, so only the invalid
+        specs fail. The results are returned in the order of <specs>, each in
+        the format of :meth:`query` ([] when it failed).
 
-    def gen_id(self, tid="", desc=""):
-        assert tid in self.ids.keys(), "Field <tip> is not valid."
-        assert desc, "Field <desc> is not valid."
+        Parameters
+        ----------
+        'specs' : array, required
+            Dicts with the 'queries' of a :meth:`query` call and optionally its
+            'start' (default=1h-ago), 'end' (default=now) and 'group'.
 
-        if desc not in self.ids[tid].keys():
-            if len(self.ids[tid]) == 0:
-                self.ids[tid][desc] = 1
-            else:
-                self.ids[tid][desc] = max(self.ids[tid].values()) + 1
-        return "%s%d" % (tid[:1], self.ids[tid][desc])
-
-    def build_policy(self, vpol=None):
-        assert vpol != None, \
-            'Field <vpol> must have a value.'
-
-        if vpol == 0:
-            return {'policy': 'zero'}
-        elif any(isinstance(vpol, i) for i in [int, float]):
-            return {'policy': 'scalar', 'value': vpol}
-        elif vpol in ['nan', 'null']:
-            return {'policy': vpol}
-        else:
-            assert False, 'Field <vpol> is not valid.'
-
-    def build_downsampler(self, aggr='max', interval=None, vpol=None):
-        assert interval != None, \
-            'Field <interval> is not valid.'
-        assert aggr in self.aggregators, \
-            'The aggregator is not valid. Check OTSDB docs for more details.'
-
-        ret = {'interval': interval, 'aggregator': aggr}
-        if vpol:
-            ret['fillPolicy'] = self.build_policy(vpol)
-        return ret
-
-    def build_filter(self, tags={}, group=True):
-        assert len(tags) > 0 and isinstance(tags, dict), \
-            'Field <tags> is not valid.'
-
-        obj = {"id" : self.gen_id("filter", self.dumps(tags)), "tags" : []}
-        for t in tags:
-            obj["tags"].append(
-                {
-                    "type": "literal_or",
-                    "tagk": t,
-                    "filter": tags[t],
-                    "groupBy": group
-                }
-            )
-
-        return obj
+        'nots', 'tsd', 'arrays'
+            See :meth:`query`.
+
+        'pack' : int, optional (default=20)
+            Maximum number of sub queries per request.
+
+        'concurrency' : int, optional (default=4)
+            Maximum number of requests in flight.
+
+        'att' : int, optional (default=3)
+            Number of HTTP request attempts of each request.
+
+        'compact' : boolean, optional (default=False)
+            See :meth:`query`.
+
+        Example
+        -------
+        >>> c.query_many([{'queries': [{'m': 'sys.cpu', 'aggr': 'sum', 'tags': {}}]},
+        ...               {'queries': [{'m': 'sys.mem', 'aggr': 'max', 'tags': {}}],
+        ...                'start': '1d-ago'}])
+        """
+        datas, res, packed = self._query_many_plan(specs, pack)
+        while packed:
+            resps = self._post_many("query", [p for p, _ in packed], concurrency, att,
+                partial=True)
+            retry = []
+            for (_, parts), r in zip(packed, resps):
+                # The TSD rejects the whole body when one sub query is invalid
+                # (e.g. an unknown metric): its specs are sent one at a time
+                if r is False and len(parts) > 1:
+                    retry += [(dict(datas[n], showQuery=True), [(n, 0)]) for n, _ in parts]
+                if not r:
+                    continue
+                for n, series in self._query_many_split(loads(r.text), parts).items():
+                    res[n] = series
+                    self._cache_put("query", datas[n], specs[n].get('start', '1h-ago'),
+                        specs[n].get('end', 'now'), series)
+            packed = retry
+
+        return [self._query_result(res[n], nots=nots, tsd=tsd,
+                    group=spec.get('group', False), arrays=arrays, compact=compact)
+                if n in res else []
+                for n, spec in enumerate(specs)]
+
+    def query_stream(self, queries=[], start='1h-ago', end='now', nots=False,
+        tsd=True, arrays=False, batch=None, chunk_size=65536):
+        """ Streams the series of a query while the response is downloaded.
+
+        The response is parsed in chunks and each series is yielded as soon as
+        it is complete, so memory is bounded by one series instead of the
+        whole result. The series have the same format of :meth:`query`.
+
+        Parameters
+        ----------
+        'queries', 'start', 'end', 'nots', 'tsd', 'arrays'
+            See :meth:`query`.
+
+        'batch' : int, optional (default=None)
+            Splits each series in pieces of at most <batch> points.
+
+        'chunk_size' : int, optional (default=65536)
+            Number of bytes read from the response at a time.
+        """
+        data = self._query_payload(queries, start, end)
+        r = self._request('POST', "query", data=self.dumps(data),
+            headers=self.headers, stream=True)
+        gr.map([r], stream=True, exception_handler=exception_handler)
+        resp = r.response
+
+        if resp is None or not 200 <= resp.status_code <= 300:
+            info("HTTP error code = %s" % (resp.status_code if resp is not None else None))
+            return
+
+        try:
+            chunks = resp.iter_content(chunk_size)
+            for item in self._stream_result(iter_array(chunks), nots=nots,
+                    tsd=tsd, arrays=arrays, batch=batch):
+                yield item
+        finally:
+            resp.close()
 
     def query_expressions(self, aggr='sum', start='1d-ago', end='now', vpol="nan",
-        metrics=[], exprs=[], dsampler=None, forceAggregate=False):
+        metrics=[], exprs=[], dsampler=None, forceAggregate=False, chunk=None,
+        concurrency=4, att=3):
         """ Allows for querying data using expressions.
 
         Parameters
@@ -418,144 +800,66 @@ class Connection(object):
 
         'forceAggregate': boolean, optional (default=false)
             Forces the aggregation of metrics with the same name
+
+        'chunk', 'concurrency', 'att'
+            Splits the time range in windows queried concurrently, see :meth:`query`.
         """
-        assert aggr in self.aggregators, \
-            'The aggregator is not valid. Check OTSDB docs for more details.'
-
-        assert any(isinstance(vpol, i) for i in [int, float]) or \
-                (isinstance(vpol, str) and vpol in ['null', 'nan']), \
-            'Field <vpol> is not valid.'
-
-        assert isinstance(metrics, list), 'Field <metrics> must be a list.'
-        assert len(metrics) > 0, 'Field <metrics> must have at least one element'
-        for m in metrics:
-            assert isinstance(m, dict), 'Field <element> must be a dict.'
-            assert all(i in m.keys() for i in ['m', 'tags']), \
-                'Not all required element keys were informed.'
-            assert isinstance(m['m'], str), \
-                'Field <metric> must be a string.'
-            assert isinstance(m['tags'], dict), \
-                'Field <tags> must be a dict'
-
-        assert isinstance(exprs, list), 'Field <exprs> must be a list.'
-        assert len(exprs) > 0, 'Field <exprs> must have at least one metric'
-        for e in exprs:
-            assert len(e) == 2, \
-                'Tuple must have the (id, expr) format.'
-            assert isinstance(e[0], str), \
-                'Field <id> must be a string.'
-            assert isinstance(e[1], str), \
-                'Field <expr> must be a string.'
-
-        if dsampler:
-            assert 2 <= len(dsampler) <= 3, \
-                'Field <dsampler> must be composed by (interval, aggr) ' \
-                'or (interval, aggr, vpol).'
-            assert isinstance(dsampler[0], str), \
-                'Field <interval> must be a string.'
-            assert dsampler[1] in self.aggregators, \
-                'Field <aggr> is not a valid aggregator.'
-        # Setting <time> definitions
-        time = {
-            'start': start,
-            'aggregator': aggr,
-            'end': end
-        }
-        if dsampler:
-            time['downsampler'] = self.build_downsampler(
-                interval=dsampler[0], aggr=dsampler[1],
-                vpol=dsampler[2] if len(dsampler) == 3 else None)
-
-        # Setting <filters> definitions
-        filters = {self.dumps(i): self.build_filter(tags=i['tags']) for i in metrics}
-
-        # Setting <metric> definitions
-        q_metrics = []
-        for m in metrics:
-            obj = {
-                'id': self.gen_id(tid="metric", desc=self.dumps(m)),
-                'filter': filters[self.dumps(m)]['id'],
-                'metric': m['m']
-            }
-            if vpol is not None:
-                obj['fillPolicy'] = self.build_policy(vpol)
-            q_metrics.append(obj)
-
-        filters = filters.values()
-        filters = [i for n, i in enumerate(filters) if i not in filters[n + 1:]]
-
-        assert isinstance(filters, list) and len(filters) > 0, \
-            'Object filter is not valid.'
-
-        # Setting <expression> definitions
-        q_exprs = []
-        for e in exprs:
-            m_id = e[1]
-            for i, j in self.ids["metric"].iteritems():
-                m_id = m_id.replace(i, "m%d" % j)
-
-            obj = {
-                'id': e[0],
-                'expr': m_id
-            }
-
-            q_exprs.append(obj)
-
-        outputs = [
-            {
-                'id': e[0],
-                'alias': 'Expression %s' % e[0]
-            } for e in exprs]
-
-        # Building the data query
-        data = {
-           'time': time,
-           'metrics': q_metrics,
-           'filters': filters,
-           'expressions': q_exprs,
-           'outputs': outputs
-        }
-
-        # Sending request to OTSDB and capturing HTTP response
-        resp = self._post(endpoint="query_exp", data=data)
-        res = self.process_response(resp)
-
-        if forceAggregate == True:
-            for i in range(len(res["outputs"])):
-                # Forcing the aggregation
-                dps = res["outputs"][i]["dps"]
-                new_dps = []
-                for dp in dps:
-                    if len(dp) > 2:
-                        new_dps.append([dp[0], sum(dp[1:])])
-                res["outputs"][i]["dps"] = new_dps
-                res["outputs"][i]["dpsMeta"]["series"] = 1
-                res["outputs"][i]["meta"] = []
-        return res
+        data = self._query_exp_payload(aggr=aggr, start=start, end=end,
+            vpol=vpol, metrics=metrics, exprs=exprs, dsampler=dsampler)
+
+        res = self._cache_get("query_exp", data, start, end)
+        if res is None:
+            if chunk:
+                # Windows cut on the downsample buckets, so none spans a seam
+                payloads = [dict(data, time=dict(data['time'], start=s, end=e))
+                            for s, e in self._time_windows(start, end, chunk,
+                                dsampler[0] if dsampler else None)]
+                resps = self._post_many("query_exp", payloads, concurrency, att)
+                if resps is None:
+                    return False
+                res = self._merge_exp([self.process_response(r) for r in resps])
+            else:
+                # Sending request to OTSDB and capturing HTTP response
+                resp = self._post(endpoint="query_exp", data=data)
+                res = self.process_response(resp)
+            if res:
+                self._cache_put("query_exp", data, start, end, res)
+
+        return self._exp_result(res, forceAggregate == True)
 
     def query_summing(self, aggr='sum', start='1d-ago', end='now', vpol="nan",
-        metrics=[], dsampler=None):
-        """ Sum all required metrics using query with expressions """
-        assert isinstance(metrics, list), 'Field <metrics> must be a list.'
-        assert len(metrics) > 0, 'Field <metrics> must have at least one element'
-        for m in metrics:
-            assert isinstance(m, dict), 'Field <element> must be a dict.'
-            assert all(i in m.keys() for i in ['m', 'tags']), \
-                'Not all required element keys were informed.'
-            assert isinstance(m['m'], str), \
-                'Field <metric> must be a string.'
-            assert isinstance(m['tags'], dict), \
-                'Field <tags> must be a dict'
-
-        expr = ""
-
-        for m in metrics:
-            expr += "%s + " % self.dumps(m)
-        expr = expr[:-3]
-
-        expressions = [("sum", expr)]
-        return self.query_expressions(aggr='sum', start=start, end=end, vpol=vpol,
-            metrics=metrics, exprs=expressions, dsampler=dsampler, forceAggregate=True)
-
-    def dumps(self, x):
-        return tdumps(x, default=str)
+        metrics=[], dsampler=None, split=100, concurrency=4, att=3):
+        """ Sum all required metrics using query with expressions.
+
+        Parameters
+        ----------
+        'split' : int, optional (default=100)
+            Metrics summed by each request. Longer lists are split in requests
+            sent concurrently, whose partial sums are added on the client.
+            None sends one request.
+
+        'concurrency', 'att' : int, optional (default=4, 3)
+            Requests in flight and attempts of each request.
+
+        The other parameters are those of :meth:`query_expressions`.
+        """
+        parts = self._summing_parts(metrics, split)
+        if len(parts) == 1:
+            return self.query_expressions(aggr='sum', start=start, end=end, vpol=vpol,
+                metrics=metrics, exprs=parts[0][1], dsampler=dsampler, forceAggregate=True)
+
+        payloads = [self._query_exp_payload(aggr='sum', start=start, end=end,
+            vpol=vpol, metrics=m, exprs=e, dsampler=dsampler) for m, e in parts]
+        results = [self._cache_get("query_exp", p, start, end) for p in payloads]
+        missing = [n for n, r in enumerate(results) if r is None]
+        if missing:
+            resps = self._post_many("query_exp", [payloads[n] for n in missing],
+                concurrency, att)
+            if resps is None:
+                return False
+            for n, r in zip(missing, resps):
+                results[n] = self.process_response(r)
+                if not results[n]:
+                    return results[n]
+                self._cache_put("query_exp", payloads[n], start, end, results[n])
+        return self._combine_sums(results, [len(m) for m, _ in parts], vpol)
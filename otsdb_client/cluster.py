@@ -0,0 +1,223 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import threading
+
+from logging import info
+
+from otsdb_client.client import Connection, TimedRequest, ping
+
+
+class Node(object):
+    """ A TSD of a cluster and its counters. """
+
+    def __init__(self, server, port):
+        self.server = server
+        self.port = port
+        self.url = 'http://%s:%d' % (server, port)
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors
+        }
+
+
+class NodeRequest(TimedRequest):
+    """ A request sent to the node chosen by the cluster when it starts.
+
+    When the node does not answer (or answers 503), the request is sent to
+    the next node, until every node was tried.
+    """
+
+    def __init__(self, cluster, endpoint, method, path, **kwargs):
+        super(NodeRequest, self).__init__(cluster, endpoint, method,
+            cluster.url + path, **kwargs)
+        self.cluster = cluster
+        self.path = path
+        self.node = None
+
+    def send(self, **kwargs):
+        tried = []
+        while True:
+            self.node = self.cluster._acquire(tried)
+            self.url = self.node.url + self.path
+            self.response = None
+            super(NodeRequest, self).send(**kwargs)
+            ok = self.response is not None and self.response.status_code != 503
+            self.cluster._release(self.node, ok)
+            if ok:
+                return self
+            tried.append(self.node)
+            if len(tried) >= len(self.cluster.nodes):
+                return self
+            info('Request to %s failed, trying another node' % self.node.url)
+
+
+class ClusterConnection(Connection):
+    """ Connection with several TSDs sharing the same storage.
+
+    Every request (writes, queries and the other endpoints) goes to the node
+    chosen when it is sent: in turn ('round_robin') or the one with the fewest
+    requests in flight ('least_outstanding'). A request that fails is sent to
+    another node. A node that fails <max_failures> requests in a row, or the
+    health check, is ejected; a background thread checks every node each
+    <check_interval> seconds (TCP ping then /api/version) and restores the
+    ejected ones that answer again. Like :class:`Connection`, the
+    connection is lazy: the nodes are healthy until a request or the first
+    check of the thread fails.
+
+    Parameters
+    ----------
+    'endpoints' : array, required
+        The TSDs, as (server, port) tuples or 'server:port' strings.
+
+    'balance' : string, optional (default=round_robin)
+        'round_robin' or 'least_outstanding'.
+
+    'check_interval' : float, optional (default=5)
+        Seconds between the health checks. 0 disables them.
+
+    'max_failures' : int, optional (default=3)
+        Consecutive failed requests that eject a node.
+
+    Other keyword arguments are those of :class:`otsdb_client.client.Connection`.
+    A telnet transport writes to the first node.
+    """
+
+    BALANCES = ('round_robin', 'least_outstanding')
+
+    def __init__(self, endpoints, balance='round_robin', check_interval=5,
+        max_failures=3, **kwargs):
+        assert len(endpoints) > 0, 'Field <endpoints> must not be empty.'
+        assert balance in self.BALANCES, \
+            'Field <balance> must be round_robin or least_outstanding.'
+        assert max_failures > 0, 'Field <max_failures> must be greater than 0.'
+
+        self.nodes = []
+        for e in endpoints:
+            if isinstance(e, str):
+                server, _, port = e.rpartition(':')
+                e = (server, int(port))
+            self.nodes.append(Node(*e))
+        self.balance = balance
+        self.check_interval = check_interval
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+        self._stop = threading.Event()
+        self._thread = None
+        super(ClusterConnection, self).__init__(server=self.nodes[0].server,
+            port=self.nodes[0].port, **kwargs)
+        if check_interval:
+            self._thread = threading.Thread(target=self._run, name='otsdb-health')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _healthy(self):
+        return [n for n in self.nodes if n.healthy]
+
+    def _acquire(self, exclude=()):
+        """ Chooses the node of a request and counts it in flight. """
+        with self._lock:
+            nodes = [n for n in self._healthy() if n not in exclude] or \
+                [n for n in self.nodes if n not in exclude] or self.nodes
+            turn = next(self._turn) % len(nodes)
+            if self.balance == 'least_outstanding':
+                nodes = nodes[turn:] + nodes[:turn]
+                node = min(nodes, key=lambda n: n.outstanding)
+            else:
+                node = nodes[turn]
+            node.outstanding += 1
+            node.requests += 1
+            return node
+
+    def _release(self, node, ok):
+        with self._lock:
+            node.outstanding -= 1
+            if ok:
+                node.failures = 0
+                return
+            node.errors += 1
+            node.failures += 1
+            eject = node.healthy and node.failures >= self.max_failures
+            if eject:
+                node.healthy = False
+        if eject:
+            info('Node %s ejected after %d failed requests' % (node.url, node.failures))
+
+    def _request(self, method, endpoint="", query='', **kwargs):
+        """ Builds an async request to an endpoint of the cluster. """
+        kwargs.setdefault('timeout', self.timeout)
+        return NodeRequest(self, endpoint, method, self.get_endpoint(endpoint) + query,
+            session=self._session(), **kwargs)
+
+    def _check(self, node, version=True):
+        """ True when the node accepts connections and answers /api/version. """
+        try:
+            ping(node.server, node.port)
+            if version:
+                r = self._session().get(node.url + self.get_endpoint('version'),
+                    timeout=self.timeout or 5)
+                return r.status_code == 200
+            return True
+        except Exception:
+            return False
+
+    def _run(self):
+        # The first check runs at once, not in the constructor
+        while True:
+            for node in self.nodes:
+                healthy = self._check(node)
+                with self._lock:
+                    changed = healthy != node.healthy
+                    node.healthy = healthy
+                    if healthy:
+                        node.failures = 0
+                if changed:
+                    info('Node %s %s' % (node.url, 'restored' if healthy else 'ejected'))
+            if self._stop.wait(self.check_interval):
+                return
+
+    def ping(self):
+        """ Checks that some TSD of the cluster accepts connections. Raises an
+        exception otherwise. """
+        for node in self._healthy() + [n for n in self.nodes if not n.healthy]:
+            if self._check(node, version=False):
+                return True
+        raise Exception('Can\'t connect to any OpenTSDB Server')
+
+    def cluster_stats(self):
+        """ Returns the counters of each node. """
+        with self._lock:
+            return [n.stats() for n in self.nodes]
+
+    def close(self):
+        """ Stops the health checks and closes the connection. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        super(ClusterConnection, self).close()
@@ -0,0 +1,156 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Columnar conversions used by put and query.
+
+NumPy is optional: when it is installed the conversions are vectorized,
+otherwise they fall back to the standard ``array`` module.
+"""
+
+import heapq
+from array import array
+from itertools import groupby
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def is_column(x):
+    """ True for the sequence types accepted as columns by put. """
+    if isinstance(x, (list, tuple, array, memoryview)):
+        return True
+    return np is not None and isinstance(x, np.ndarray)
+
+
+def is_buffer(x):
+    """ True for columns that are not plain Python sequences. """
+    return is_column(x) and not isinstance(x, (list, tuple))
+
+
+def floats(values):
+    """ Converts a column of numbers to a list of Python floats. """
+    if np is not None and not isinstance(values, (list, tuple)):
+        return np.asarray(values, dtype=np.float64).tolist()
+    if isinstance(values, memoryview):
+        values = values.tolist()
+    return [float(v) for v in values]
+
+
+def timestamps(values):
+    """ Converts a buffer of timestamps to a list of integers.
+
+    ``datetime64`` arrays are converted to seconds since the epoch.
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        if values.dtype.kind == 'M':
+            values = values.astype('datetime64[s]')
+        assert values.dtype.kind in 'iuM', \
+            'Field <timestamps> must be integer or datetime'
+        return values.astype(np.int64).tolist()
+    return [int(v) for v in values.tolist()]
+
+
+def dps_lists(dps):
+    """ Converts the <dps> map of a query result to sorted lists of integer
+    timestamps and float values. The keys are parsed once; the TSD already
+    answers them in order, so the sort is usually skipped. """
+    ts = list(map(int, dps.keys()))
+    vs = list(map(float, dps.values()))
+    if any(a > b for a, b in zip(ts, ts[1:])):
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        ts = [ts[i] for i in order]
+        vs = [vs[i] for i in order]
+    return ts, vs
+
+
+def merge_sum(series):
+    """ Merges sorted (timestamps, values) lists with a k-way merge, summing
+    the values that share a timestamp. """
+    merged = heapq.merge(*[zip(ts, vs) for ts, vs in series], key=itemgetter(0))
+    ts, vs = [], []
+    for t, points in groupby(merged, key=itemgetter(0)):
+        ts.append(t)
+        vs.append(sum(p[1] for p in points))
+    return ts, vs
+
+
+class Series(object):
+    """ Compact time serie: integer timestamps and float values stored in
+    ``array.array`` buffers. Supports ``len``, iteration over the
+    (timestamp, value) pairs and item access to the fields, like the dict
+    results (``s['values']``). """
+
+    __slots__ = ('metric', 'tags', 'timestamps', 'values')
+
+    def __init__(self, metric, tags, timestamps, values):
+        self.metric = metric
+        self.tags = tags
+        self.timestamps = timestamps if isinstance(timestamps, array) else array('q', timestamps)
+        self.values = values if isinstance(values, array) else array('d', values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return zip(self.timestamps, self.values)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return 'Series(metric=%r, tags=%r, points=%d)' % (self.metric, self.tags, len(self))
+
+    def to_dict(self):
+        return {'metric': self.metric, 'tags': self.tags,
+                'timestamps': list(self.timestamps), 'values': list(self.values)}
+
+
+def dps_arrays(dps):
+    """ Converts the <dps> map of a query result to sorted timestamp and
+    value arrays (``int64`` and ``float64``). """
+    n = len(dps)
+    if np is not None:
+        ts = np.array(list(dps.keys())).astype(np.int64) if n else np.empty(0, np.int64)
+        vs = np.fromiter(dps.values(), dtype=np.float64, count=n)
+        order = np.argsort(ts, kind='stable')
+        return ts[order], vs[order]
+    points = sorted((int(k), v) for k, v in dps.items())
+    return array('q', [p[0] for p in points]), array('d', [p[1] for p in points])
+
+
+def sum_arrays(columns):
+    """ Merges several (timestamps, values) arrays, summing the values that
+    share a timestamp. """
+    if np is not None:
+        if not columns:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        ts = np.concatenate([c[0] for c in columns])
+        vs = np.concatenate([c[1] for c in columns])
+        order = np.argsort(ts, kind='stable')
+        ts, vs = ts[order], vs[order]
+        uniq, first = np.unique(ts, return_index=True)
+        sums = np.add.reduceat(vs, first) if len(vs) else vs
+        return uniq, sums
+    acc = {}
+    for ts, vs in columns:
+        for t, v in zip(ts, vs):
+            acc[t] = acc.get(t, 0.0) + v
+    points = sorted(acc.items())
+    return array('q', [p[0] for p in points]), array('d', [p[1] for p in points])
@@ -0,0 +1,80 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Fast JSON encoding of the /api/put points.
+
+The metric and tags of a series are serialized once in a prefix, and the
+points only splice their timestamp and value into it.
+"""
+
+import gzip
+from math import isfinite
+
+from json import dumps
+
+# Prefixes of the recently written series
+_prefixes = {}
+_MAX_PREFIXES = 10000
+
+
+def prefix(metric, tags):
+    """ Returns the point format of a series, cached per (metric, tags). """
+    try:
+        # With the value types: 1, 1.0 and True are equal keys but are
+        # written 1, 1.0 and true
+        key = (metric, tuple((k, type(v), v) for k, v in tags.items()))
+        fmt = _prefixes.get(key)
+    except TypeError:
+        # Unhashable tag values
+        key, fmt = None, None
+    if fmt is None:
+        fmt = ('{"metric":%s,"tags":%s,"timestamp":' % (
+            dumps(metric), dumps(tags, default=str, separators=(',', ':')))
+            ).replace('%', '%%') + '%d,"value":%r}'
+        if key is not None:
+            if len(_prefixes) >= _MAX_PREFIXES:
+                _prefixes.clear()
+            _prefixes[key] = fmt
+    return fmt
+
+
+def _slow(fmt, ts, value):
+    # Values that repr does not write as JSON (NaN, strings, ...)
+    head = fmt[:fmt.rindex('%d')].replace('%%', '%')
+    return '%s%s,"value":%s}' % (head, dumps(ts), dumps(value, default=str))
+
+
+def point(fmt, ts, value):
+    """ Encodes one point with the format returned by :func:`prefix`. """
+    if type(value) is float and isfinite(value) and type(ts) is int:
+        return fmt % (ts, value)
+    return _slow(fmt, ts, value)
+
+
+def series(fmt, timestamps, values):
+    """ Encodes the points of a series. <values> must be floats. """
+    if all(map(isfinite, values)) and all(type(t) is int for t in timestamps):
+        return [fmt % p for p in zip(timestamps, values)]
+    return [point(fmt, t, v) for t, v in zip(timestamps, values)]
+
+
+def body(points):
+    """ The /api/put body of a batch of encoded points. """
+    return '[' + ','.join(points) + ']'
+
+
+def compress(data, level=1):
+    """ Gzips a request body. """
+    return gzip.compress(data.encode('utf-8'), level)
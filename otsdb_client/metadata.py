@@ -0,0 +1,75 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+
+class MetadataCache(object):
+    """ Cache of the server metadata (aggregators, filters, version and the
+    result of the ping), keyed on the URL of the server.
+
+    The connections share :data:`SHARED` by default, so the connections of
+    a process to the same TSD fetch the metadata once per <refresh> seconds.
+
+    Parameters
+    ----------
+    'refresh' : float, optional (default=300)
+        Seconds a value stays valid.
+    """
+
+    def __init__(self, refresh=300):
+        assert refresh > 0, 'Field <refresh> must be greater than 0.'
+        self.refresh = refresh
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, name):
+        """ Returns the cached value, or None when it is missing or expired. """
+        with self._lock:
+            entry = self._data.get((url, name))
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def put(self, url, name, value):
+        """ Caches <value>. Failures (None, False or empty answers) are not
+        cached. """
+        if not value:
+            return
+        with self._lock:
+            self._data[(url, name)] = (time.time() + self.refresh, value)
+
+    def fetch(self, url, name, fn):
+        """ Returns the cached value, calling <fn> to fetch it when needed.
+        The lock is not held while fetching: greenlets of the same thread
+        may fetch concurrently. """
+        value = self.get(url, name)
+        if not value:
+            value = fn()
+            self.put(url, name, value)
+        return value
+
+    def invalidate(self, url=None):
+        """ Drops the values of <url>, or all of them. """
+        with self._lock:
+            if url is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k[0] == url]:
+                    del self._data[key]
+
+
+SHARED = MetadataCache()
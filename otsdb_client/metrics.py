@@ -0,0 +1,180 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+from bisect import bisect_left
+
+from logging import info
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets, in milliseconds. """
+
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if self.min is None or ms < self.min:
+            self.min = ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the percentile <p> (0-100). """
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for n, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.bounds[n] if n < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = {}
+        for n, c in enumerate(self.counts):
+            if c:
+                key = '<=%d' % self.bounds[n] if n < len(self.bounds) else '>%d' % self.bounds[-1]
+                buckets[key] = c
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': buckets
+        }
+
+
+class Metrics(object):
+    """ In-process registry of the client metrics.
+
+    Records, per endpoint, the number of requests and errors, the bytes sent
+    and received and a latency histogram; counters (retries, points written,
+    failed or spooled) and gauges read when the snapshot is taken (the queue
+    depth of the writer). Hooks are called with each recorded request.
+
+    Example
+    -------
+    >>> c.metrics.snapshot()['endpoints']['put']['latency']['p99']
+    20
+    >>> c.metrics.add_hook(lambda event, data: print(event, data))
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._counters = {}
+        self._gauges = {}
+        self._hooks = []
+        self.started = time.time()
+
+    def _endpoint(self, endpoint):
+        e = self._endpoints.get(endpoint)
+        if e is None:
+            e = self._endpoints[endpoint] = {
+                'requests': 0,
+                'errors': 0,
+                'bytes_sent': 0,
+                'bytes_received': 0,
+                'latency': Histogram()
+            }
+        return e
+
+    def request(self, endpoint, status, sent, received, seconds):
+        """ Records a request. <status> is None when the request failed. """
+        ms = seconds * 1000.0
+        with self._lock:
+            e = self._endpoint(endpoint)
+            e['requests'] += 1
+            if status is None or status >= 400:
+                e['errors'] += 1
+            e['bytes_sent'] += sent
+            e['bytes_received'] += received
+            e['latency'].observe(ms)
+        if self._hooks:
+            self._call('request', {'endpoint': endpoint, 'status': status,
+                'sent': sent, 'received': received, 'ms': ms})
+
+    def incr(self, name, n=1):
+        """ Adds <n> to the counter <name>. """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        if self._hooks:
+            self._call('counter', {'name': name, 'value': n})
+
+    def gauge(self, name, fn):
+        """ Registers a gauge: <fn> is called when a snapshot is taken. """
+        with self._lock:
+            self._gauges[name] = fn
+
+    def add_hook(self, fn):
+        """ Calls fn(event, data) on every request ('request') and counter
+        increment ('counter'). It runs in the thread of the request. """
+        with self._lock:
+            self._hooks.append(fn)
+
+    def remove_hook(self, fn):
+        with self._lock:
+            self._hooks.remove(fn)
+
+    def _call(self, event, data):
+        for fn in list(self._hooks):
+            try:
+                fn(event, data)
+            except Exception as err:
+                info('Metrics hook failed: %s' % err)
+
+    def snapshot(self):
+        """ Returns the current values of the metrics. """
+        with self._lock:
+            endpoints = {}
+            for name, e in self._endpoints.items():
+                endpoints[name] = dict(e, latency=e['latency'].snapshot())
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        values = {}
+        for name, fn in gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:
+                values[name] = None
+        return {
+            'uptime': time.time() - self.started,
+            'endpoints': endpoints,
+            'counters': counters,
+            'gauges': values
+        }
+
+    def reset(self):
+        """ Clears the endpoints and counters. The gauges and hooks are kept. """
+        with self._lock:
+            self._endpoints = {}
+            self._counters = {}
+            self.started = time.time()
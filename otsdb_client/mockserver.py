@@ -0,0 +1,442 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Local stand-in of an OpenTSDB server, for benchmarks and development.
+
+It implements the endpoints used by the client on top of an in-memory store.
+Run it with ``python -m otsdb_client.mockserver --port 4242``. Since
+grequests monkey-patches the process that imports the client, start it in a
+separate process (see :meth:`MockTSD.spawn`) when the client runs in the
+same program.
+"""
+
+import argparse
+import gzip
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import isfinite
+
+from json import dumps, loads
+from urllib.parse import parse_qs, urlsplit
+
+from otsdb_client import timeutil
+
+
+def _aggregate(aggr, values):
+    if aggr == 'sum' or aggr == 'zimsum':
+        return sum(values)
+    if aggr in ('min', 'mimmin'):
+        return min(values)
+    if aggr in ('max', 'mimmax'):
+        return max(values)
+    if aggr == 'count':
+        return len(values)
+    return sum(values) / len(values)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, obj=None):
+        body = dumps(obj).encode('utf-8') if obj is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        tsd = self.server.tsd
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        body = None
+        if method == 'POST':
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+
+        status, obj = tsd.handle(method, url.path, params, body)
+        self._send(status, obj)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class MockTSD(object):
+    """ HTTP server implementing /api/put, /api/query, /api/query/exp,
+    /api/suggest, /api/aggregators, /api/version and /api/config/filters.
+
+    The points written with /api/put are kept in memory and returned by the
+    queries. Metrics without points may be answered with synthetic series,
+    to measure the parsing of large responses. Otherwise, like the TSD, a
+    /api/query naming a metric that was never written is answered with 400.
+
+    Parameters
+    ----------
+    'host' : string, optional (default=127.0.0.1)
+        The address to listen on.
+
+    'port' : int, optional (default=0)
+        The port to listen on. 0 picks a free port.
+
+    'latency' : float or tuple, optional (default=0)
+        Seconds waited before answering, or the (min, max) of a uniform delay.
+
+    'error_rate' : float, optional (default=0)
+        Fraction of the requests answered with <error_status>.
+
+    'error_status' : int, optional (default=503)
+        Status of the injected errors.
+
+    'error_endpoints' : array, optional (default=None)
+        Paths ('/api/put', ...) where errors are injected. None means all.
+
+    'synthetic' : int, optional (default=0)
+        Number of points of the synthetic series answered for the metrics
+        that have no points.
+
+    'seed' : int, optional (default=None)
+        Seed of the latency and error injection.
+
+    Example
+    -------
+    >>> with MockTSD(latency=0.005, error_rate=0.01) as tsd:
+    ...     c = Connection(port=tsd.port)
+    """
+
+    AGGREGATORS = ['sum', 'min', 'max', 'avg', 'count', 'zimsum', 'mimmin',
+                   'mimmax', 'none', 'dev', 'first', 'last']
+    VERSION = {'version': '2.4.0', 'short_revision': 'mock', 'repo_status': 'MODIFIED'}
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0.0,
+        error_status=503, error_endpoints=None, synthetic=0, seed=None):
+        assert 0 <= error_rate <= 1, 'Field <error_rate> must be between 0 and 1.'
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_endpoints = error_endpoints
+        self.synthetic = synthetic
+        self.random = random.Random(seed)
+        self.requests = {}
+        self._series = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def start(self):
+        """ Starts serving in a background thread. Returns the port. """
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.tsd = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+            name='otsdb-mock')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def spawn(port=0, **kwargs):
+        """ Runs a server in a child process and waits until it accepts
+        connections. Returns the process and its port. The keyword arguments
+        are the command line options (latency, error_rate, synthetic, ...). """
+        if not port:
+            s = socket.socket()
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+            s.close()
+        args = [sys.executable, '-m', 'otsdb_client.mockserver', '--port', str(port)]
+        for k, v in kwargs.items():
+            args += ['--' + k.replace('_', '-'), str(v)]
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(p for p in [root, env.get('PYTHONPATH')] if p)
+        proc = subprocess.Popen(args, env=env)
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        return proc, port
+
+    def clear(self):
+        """ Drops the stored points and the request counters. """
+        with self._lock:
+            self._series = {}
+            self.requests = {}
+
+    def points(self):
+        """ Number of points stored. """
+        with self._lock:
+            return sum(len(s) for s in self._series.values())
+
+    def handle(self, method, path, params, body):
+        """ Answers a request. Returns its status and JSON body. """
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+        delay = self.latency
+        if isinstance(delay, (tuple, list)):
+            delay = self.random.uniform(*delay)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and (self.error_endpoints is None or
+                path in self.error_endpoints) and self.random.random() < self.error_rate:
+            return self.error_status, {'error': {'code': self.error_status,
+                'message': 'Injected error'}}
+
+        try:
+            if path == '/api/aggregators':
+                return 200, self.AGGREGATORS
+            if path == '/api/version':
+                return 200, self.VERSION
+            if path == '/api/config/filters':
+                return 200, {'literal_or': {}, 'wildcard': {}, 'regexp': {}}
+            if path == '/api/stats':
+                return 200, []
+            if path == '/api/suggest':
+                return 200, self.suggest(params.get('type', 'metrics'),
+                    params.get('q', ''), int(params.get('max', 25)))
+            if method != 'POST':
+                return 405, {'error': {'code': 405, 'message': 'Method not allowed'}}
+            data = loads(body)
+            if path == '/api/put':
+                return self.put(data, params)
+            if path == '/api/query':
+                return 200, self.query(data)
+            if path == '/api/query/exp':
+                return 200, self.query_exp(data)
+        except (ValueError, KeyError, TypeError) as err:
+            return 400, {'error': {'code': 400, 'message': str(err)}}
+        return 404, {'error': {'code': 404, 'message': 'Endpoint not found'}}
+
+    def suggest(self, type, q, max):
+        with self._lock:
+            keys = list(self._series.keys())
+        if type == 'metrics':
+            names = set(k[0] for k in keys)
+        elif type == 'tagk':
+            names = set(t[0] for k in keys for t in k[1])
+        else:
+            names = set(t[1] for k in keys for t in k[1])
+        return sorted(n for n in names if n.startswith(q))[:max]
+
+    def _error(self, dp):
+        if not isinstance(dp, dict):
+            return 'Unable to parse the datapoint'
+        if not isinstance(dp.get('metric'), str) or not dp['metric']:
+            return 'Missing metric'
+        if not isinstance(dp.get('tags'), dict) or not dp['tags']:
+            return 'Missing tags'
+        if not isinstance(dp.get('timestamp'), int):
+            return 'Invalid timestamp'
+        value = dp.get('value')
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                return 'Unable to parse value to a number'
+        if not isinstance(value, (int, float)) or not isfinite(value):
+            return 'Invalid value'
+        return None
+
+    def put(self, data, params):
+        if isinstance(data, dict):
+            data = [data]
+        errors = []
+        stored = 0
+        with self._lock:
+            for dp in data:
+                error = self._error(dp)
+                if error:
+                    errors.append({'datapoint': dp, 'error': error})
+                    continue
+                key = (dp['metric'], tuple(sorted((k, str(v)) for k, v in dp['tags'].items())))
+                self._series.setdefault(key, {})[timeutil.to_millis(dp['timestamp'])] = \
+                    float(dp['value'])
+                stored += 1
+
+        summary = {'success': stored, 'failed': len(errors)}
+        if 'details' in params:
+            summary['errors'] = errors
+        if errors:
+            return 400, summary
+        if 'details' in params or 'summary' in params:
+            return 200, summary
+        return 204, None
+
+    def _match(self, key, metric, tags):
+        if key[0] != metric:
+            return False
+        have = dict(key[1])
+        for k, f in tags.items():
+            if f == '*':
+                if k not in have:
+                    return False
+            elif have.get(k) not in f.split('|'):
+                return False
+        return True
+
+    def _synthetic(self, metric, start, end):
+        n = self.synthetic
+        step = max((end - start) // max(n, 1), 1000)
+        return {start + i * step: float(i % 100) for i in range(n) if start + i * step <= end}
+
+    def _select(self, metric, tags, aggr, start, end):
+        """ The aggregated series of a sub query, keyed on the grouped tags. """
+        with self._lock:
+            series = [(dict(k[1]), {t: v for t, v in dps.items() if start <= t <= end})
+                      for k, dps in self._series.items() if self._match(k, metric, tags)]
+        if not series and self.synthetic:
+            series = [(dict((k, 'synthetic') for k in tags), self._synthetic(metric, start, end))]
+
+        group_by = [k for k, f in tags.items() if f == '*' or '|' in f]
+        groups = {}
+        for stags, dps in series:
+            gkey = tuple(stags.get(k) for k in group_by)
+            groups.setdefault(gkey, []).append((stags, dps))
+
+        results = []
+        for members in groups.values():
+            common = dict(members[0][0])
+            for stags, _ in members[1:]:
+                common = {k: v for k, v in common.items() if stags.get(k) == v}
+            values = {}
+            for _, dps in members:
+                for t, v in dps.items():
+                    values.setdefault(t, []).append(v)
+            dps = {t: _aggregate(aggr, vs) for t, vs in sorted(values.items())}
+            aggregated = sorted(set(k for s, _ in members for k in s) - set(common))
+            results.append((common, aggregated, dps))
+        return results
+
+    def query(self, data):
+        now = timeutil.now_millis()
+        start = timeutil.to_millis(data['start'], now)
+        end = timeutil.to_millis(data.get('end'), now)
+        ms = data.get('msResolution', False)
+        if not self.synthetic:
+            with self._lock:
+                known = set(k[0] for k in self._series)
+            for q in data['queries']:
+                if q['metric'] not in known:
+                    raise ValueError("No such name for 'metrics': '%s'" % q['metric'])
+        out = []
+        for index, q in enumerate(data['queries']):
+            for tags, aggregated, dps in self._select(q['metric'], q.get('tags', {}),
+                    q['aggregator'], start, end):
+                serie = {
+                    'metric': q['metric'],
+                    'tags': tags,
+                    'aggregateTags': aggregated,
+                    'dps': {str(t if ms else t // 1000): v for t, v in dps.items()}
+                }
+                # Like the TSD, the query is echoed only with showQuery
+                if data.get('showQuery'):
+                    serie['query'] = dict(q, index=index)
+                out.append(serie)
+        if any(q.get('show_summary') for q in data['queries']):
+            out.append({'statsSummary': {'queryIdx_00': 0, 'processingPreWriteTime': 0}})
+        return out
+
+    def query_exp(self, data):
+        """ Answers every output with the series of the metrics of the query,
+        one value column per metric. The expressions are not evaluated. """
+        now = timeutil.now_millis()
+        qtime = data['time']
+        start = timeutil.to_millis(qtime['start'], now)
+        end = timeutil.to_millis(qtime.get('end'), now)
+        filters = {f['id']: f for f in data.get('filters', [])}
+
+        columns = []
+        for m in data['metrics']:
+            tags = {t['tagk']: t['filter'] for t in filters.get(m.get('filter'), {}).get('tags', [])}
+            for _, _, dps in self._select(m['metric'], tags, qtime['aggregator'], start, end):
+                columns.append(dps)
+
+        timestamps = sorted(set(t for c in columns for t in c))
+        dps = [[t] + [c.get(t, float('nan')) for c in columns] for t in timestamps]
+        outputs = [{
+            'id': o['id'],
+            'alias': o.get('alias', o['id']),
+            'dps': dps,
+            'dpsMeta': {
+                'firstTimestamp': timestamps[0] if timestamps else 0,
+                'lastTimestamp': timestamps[-1] if timestamps else 0,
+                'setCount': len(timestamps),
+                'series': len(columns)
+            },
+            'meta': [{'index': 0, 'metrics': ['timestamp']}] +
+                [{'index': n + 1, 'metrics': []} for n in range(len(columns))]
+        } for o in data.get('outputs', [])]
+        return {'outputs': outputs, 'query': data}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in of an OpenTSDB server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4242)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--synthetic', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    tsd = MockTSD(host=args.host, port=args.port, latency=args.latency,
+        error_rate=args.error_rate, error_status=args.error_status,
+        synthetic=args.synthetic, seed=args.seed)
+    tsd.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        tsd.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Token bucket of <rate> tokens per second holding at most <burst>
+    seconds of tokens. """
+
+    def __init__(self, rate, burst=1.0):
+        assert rate > 0, 'Field <rate> must be greater than 0.'
+        assert burst > 0, 'Field <burst> must be greater than 0.'
+        self.rate = float(rate)
+        self.capacity = self.rate * burst
+        self.tokens = self.capacity
+        self.updated = time.time()
+
+    def _fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, n, now):
+        """ Seconds until <n> tokens are available. More tokens than the
+        capacity are available when the bucket is full. """
+        self._fill(now)
+        need = min(n, self.capacity)
+        return 0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, n):
+        # May go negative for requests larger than the capacity
+        self.tokens -= n
+
+
+class AdaptiveConcurrency(object):
+    """ Limit of the requests in flight, adjusted AIMD-style: it grows by one
+    request per window of <limit> requests answered within <latency>
+    seconds, and is multiplied by <backoff> on 5xx, 429 or failed requests,
+    at most once per window (only for requests sent after the last cut).
+
+    Parameters
+    ----------
+    'initial' : int, optional (default=4)
+        The first limit.
+
+    'minimum', 'maximum' : int, optional (default=1, 64)
+        Bounds of the limit.
+
+    'latency' : float, optional (default=1.0)
+        Seconds above which a request is slow: the limit stops growing.
+
+    'backoff' : float, optional (default=0.5)
+        Factor applied to the limit on failures.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, latency=1.0, backoff=0.5):
+        assert 1 <= minimum <= initial <= maximum, \
+            'Field <initial> must be between <minimum> and <maximum>, and <minimum> >= 1.'
+        assert latency > 0, 'Field <latency> must be greater than 0.'
+        assert 0 < backoff < 1, 'Field <backoff> must be between 0 and 1.'
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency = latency
+        self.backoff = backoff
+        self._limit = float(initial)
+        self.cuts = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def success(self, seconds):
+        if seconds <= self.latency:
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+
+    def failure(self):
+        self._limit = max(self.minimum, self._limit * self.backoff)
+        self.cuts += 1
+
+
+class RateLimiter(object):
+    """ Paces the /api/put requests of a connection: at most <points> points
+    and <requests> requests per second (token buckets allowing bursts of
+    <burst> seconds), and at most <concurrency> requests in flight.
+
+    Parameters
+    ----------
+    'points' : float, optional (default=None)
+        Points per second. None does not limit them.
+
+    'requests' : float, optional (default=None)
+        Requests per second. None does not limit them.
+
+    'concurrency' : int, AdaptiveConcurrency or boolean, optional (default=True)
+        Requests in flight: a fixed number, an
+        :class:`AdaptiveConcurrency` or True for one with the default
+        settings. None or False leaves it to the caller.
+
+    'burst' : float, optional (default=1.0)
+        Seconds of tokens the buckets hold.
+
+    Example
+    -------
+    >>> c = Connection(ratelimit=RateLimiter(points=50000, requests=500,
+    ...     concurrency=AdaptiveConcurrency(maximum=32)))
+    """
+
+    # Seconds between the checks of a caller waiting for a free slot
+    POLL = 0.005
+
+    def __init__(self, points=None, requests=None, concurrency=True, burst=1.0):
+        self.points = TokenBucket(points, burst) if points else None
+        self.requests = TokenBucket(requests, burst) if requests else None
+        if concurrency is True:
+            concurrency = AdaptiveConcurrency()
+        self.adaptive = concurrency if isinstance(concurrency, AdaptiveConcurrency) else None
+        self.fixed = concurrency if concurrency and self.adaptive is None else None
+        self.inflight = 0
+        self.waited = 0.0
+        self._seq = 0
+        self._cut = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """ Current limit of requests in flight, None without limit. """
+        return self.adaptive.limit if self.adaptive is not None else self.fixed
+
+    def acquire(self, points):
+        """ Takes the tokens and a slot of a request of <points> points when it
+        can be sent now. Returns (0, ticket), or (seconds to wait, None). """
+        with self._lock:
+            now = time.time()
+            limit = self.limit
+            if limit is not None and self.inflight >= limit:
+                self.waited += self.POLL
+                return self.POLL, None
+            wait = max(self.points.wait(points, now) if self.points else 0,
+                       self.requests.wait(1, now) if self.requests else 0)
+            if wait:
+                self.waited += wait
+                return wait, None
+            if self.points:
+                self.points.take(points)
+            if self.requests:
+                self.requests.take(1)
+            self.inflight += 1
+            self._seq += 1
+            return 0, self._seq
+
+    def release(self, ticket, status, seconds):
+        """ Frees the slot of a request, answered with <status> (None when it
+        failed) after <seconds>. """
+        with self._lock:
+            self.inflight -= 1
+            if self.adaptive is None:
+                return
+            if status is None or status >= 500 or status == 429:
+                # One cut per window: the requests sent before the last cut
+                # saw the old limit
+                if ticket > self._cut:
+                    self.adaptive.failure()
+                    self._cut = self._seq
+            else:
+                self.adaptive.success(seconds)
+
+    def wait(self, points):
+        """ Blocks until a request of <points> points can be sent. Returns its
+        ticket. With gevent, only the calling greenlet sleeps. """
+        while True:
+            delay, ticket = self.acquire(points)
+            if not delay:
+                return ticket
+            time.sleep(delay)
+
+    def stats(self):
+        """ The current limit, the requests in flight, the cuts of the adaptive
+        limit and the seconds of waits handed to the callers (summed over the
+        waiting callers). """
+        return {
+            'limit': self.limit,
+            'inflight': self.inflight,
+            'cuts': self.adaptive.cuts if self.adaptive is not None else 0,
+            'waited': self.waited
+        }
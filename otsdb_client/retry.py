@@ -0,0 +1,82 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import random
+
+
+class RetryPolicy(object):
+    """ Retry rules of the put requests.
+
+    A batch is sent again when the request fails (connection error or
+    timeout) or answers one of the retryable <statuses>. When the TSD answers
+    400 with the details of the failed points, only the points whose error is
+    not permanent (an invalid point will never be accepted) are sent again.
+    Attempts are spaced by an exponential backoff with jitter.
+
+    Parameters
+    ----------
+    'attempts' : int, optional (default=5)
+        Maximum number of attempts of each batch.
+
+    'backoff' : float, optional (default=0.1)
+        Delay in seconds before the second attempt.
+
+    'factor' : float, optional (default=2.0)
+        Multiplier of the delay at each attempt.
+
+    'max_backoff' : float, optional (default=10.0)
+        Maximum delay in seconds between attempts.
+
+    'jitter' : boolean, optional (default=True)
+        Draws the delay uniformly between 0 and the backoff ("full jitter").
+
+    'statuses' : tuple, optional
+        HTTP status codes that are retried.
+
+    'permanent' : tuple, optional
+        Fragments of the TSD error messages of points that are not retried.
+    """
+
+    STATUSES = (408, 429, 500, 502, 503, 504)
+    PERMANENT = ('Unable to parse', 'Invalid', 'invalid', 'Unknown', 'unknown',
+                 'No such name', 'illegal', 'Illegal', 'must', 'Missing', 'missing')
+
+    def __init__(self, attempts=5, backoff=0.1, factor=2.0, max_backoff=10.0,
+        jitter=True, statuses=STATUSES, permanent=PERMANENT):
+        assert attempts > 0, 'Field <attempts> must be greater than 0.'
+        assert backoff >= 0, 'Field <backoff> must not be negative.'
+        self.attempts = attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = tuple(statuses)
+        self.permanent = tuple(permanent)
+
+    def delay(self, attempt):
+        """ Seconds to wait after the failed attempt number <attempt> (from 1). """
+        d = min(self.max_backoff, self.backoff * self.factor ** (attempt - 1))
+        return random.uniform(0, d) if self.jitter else d
+
+    def retry_status(self, status):
+        """ True when a batch answered with <status> (None for a failed
+        request) must be sent again. """
+        return status is None or status in self.statuses
+
+    def retry_error(self, message):
+        """ True when a point rejected with the error <message> may be
+        accepted if sent again. """
+        message = str(message)
+        return not any(p in message for p in self.permanent)
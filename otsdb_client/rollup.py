@@ -0,0 +1,319 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Client-side downsampling of query results.
+
+The points are aggregated in time buckets aligned on the epoch, like the
+downsampling of OpenTSDB. The aggregation is vectorized when NumPy is
+installed and falls back to plain Python otherwise.
+"""
+
+import math
+import re
+import time
+from datetime import datetime
+
+from otsdb_client import timeutil
+from otsdb_client.columns import np
+
+AGGREGATORS = ('sum', 'avg', 'min', 'max', 'count', 'first', 'last', 'dev')
+_PERCENTILE = re.compile(r'^p(\d+(\.\d+)?)$')
+
+# Aggregators that can be computed again from coarser buckets of themselves
+_DECOMPOSABLE = {'sum': 'sum', 'min': 'min', 'max': 'max', 'count': 'sum'}
+
+
+def _percentile(aggr):
+    """ The percentile of an aggregator, read like the names of OpenTSDB: p95
+    is 95 and p999 is 99.9. None when <aggr> is not a percentile up to 100. """
+    m = _PERCENTILE.match(aggr)
+    if not m:
+        return None
+    p = float(m.group(1))
+    if p > 100 and m.group(2) is None and m.group(1).startswith('99'):
+        p = float('99.' + m.group(1)[2:])
+    return p if p <= 100 else None
+
+
+def _check_aggr(aggr):
+    assert aggr in AGGREGATORS or _percentile(aggr) is not None, \
+        'Field <aggr> must be one of %s or a percentile (p50, p95, p999).' % ', '.join(AGGREGATORS)
+
+
+def _fill_value(fill):
+    """ The value of the empty buckets for a fill policy in the format of
+    :meth:`BaseConnection.build_policy` (None means no fill). """
+    if fill is None:
+        return None
+    if isinstance(fill, dict):
+        policy = fill.get('policy')
+        fill = {'zero': 0, 'nan': 'nan', 'null': 'null'}.get(policy, fill.get('value'))
+    if fill == 'nan':
+        return float('nan')
+    if fill == 'null':
+        return fill
+    assert isinstance(fill, (int, float)), 'Field <fill> is not valid.'
+    return float(fill)
+
+
+def _epoch(timestamps):
+    """ Epoch seconds of datetime timestamps (local time, like the results of
+    ``query`` with ``tsd=True``). Other timestamps are kept. """
+    if len(timestamps) and isinstance(timestamps[0], datetime):
+        return [int(time.mktime(t.timetuple())) for t in timestamps]
+    return timestamps
+
+
+def _list(values):
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+def _step(interval, timestamps):
+    """ The bucket width in the unit of <timestamps> (seconds or ms). """
+    step = timeutil.interval(interval)
+    if len(timestamps) and max(timestamps) < 1e12:
+        step = step // 1000
+    assert step > 0, 'Field <interval> is shorter than the timestamp resolution.'
+    return step
+
+
+def _py_aggregate(aggr, vs):
+    if aggr == 'sum':
+        return math.fsum(vs)
+    if aggr == 'avg':
+        return math.fsum(vs) / len(vs)
+    if aggr == 'min':
+        return min(vs)
+    if aggr == 'max':
+        return max(vs)
+    if aggr == 'count':
+        return float(len(vs))
+    if aggr == 'first':
+        return vs[0]
+    if aggr == 'last':
+        return vs[-1]
+    if aggr == 'dev':
+        mean = math.fsum(vs) / len(vs)
+        return math.sqrt(math.fsum((v - mean) ** 2 for v in vs) / len(vs))
+    # Percentile, linear interpolation between the closest ranks
+    vs = sorted(vs)
+    rank = _percentile(aggr) / 100 * (len(vs) - 1)
+    lo = int(math.floor(rank))
+    hi = min(lo + 1, len(vs) - 1)
+    return vs[lo] + (vs[hi] - vs[lo]) * (rank - lo)
+
+
+def _py_rollup(ts, vs, step, aggr):
+    buckets = {}
+    order = []
+    for t, v in zip(ts, vs):
+        b = t - t % step
+        if b not in buckets:
+            buckets[b] = []
+            order.append(b)
+        buckets[b].append(v)
+    order.sort()
+    return order, [_py_aggregate(aggr, buckets[b]) for b in order]
+
+
+def _np_rollup(ts, vs, step, aggr):
+    ts = np.asarray(ts, dtype=np.int64)
+    vs = np.asarray(vs, dtype=np.float64)
+    buckets = ts - ts % step
+    order = np.lexsort((vs, buckets)) if _PERCENTILE.match(aggr) else \
+        np.argsort(buckets, kind='stable')
+    buckets, vs = buckets[order], vs[order]
+    keys, first, counts = np.unique(buckets, return_index=True, return_counts=True)
+    if aggr in ('sum', 'avg', 'dev'):
+        sums = np.add.reduceat(vs, first)
+        if aggr == 'sum':
+            return keys, sums
+        means = sums / counts
+        if aggr == 'avg':
+            return keys, means
+        sq = np.add.reduceat((vs - np.repeat(means, counts)) ** 2, first)
+        return keys, np.sqrt(sq / counts)
+    if aggr == 'min':
+        return keys, np.minimum.reduceat(vs, first)
+    if aggr == 'max':
+        return keys, np.maximum.reduceat(vs, first)
+    if aggr == 'count':
+        return keys, counts.astype(np.float64)
+    if aggr == 'first':
+        return keys, vs[first]
+    if aggr == 'last':
+        return keys, vs[first + counts - 1]
+    # Percentile: the values are sorted inside each bucket
+    rank = _percentile(aggr) / 100 * (counts - 1)
+    lo = np.floor(rank).astype(np.int64)
+    hi = np.minimum(lo + 1, counts - 1)
+    low, high = vs[first + lo], vs[first + hi]
+    return keys, low + (high - low) * (rank - lo)
+
+
+def _fill(keys, values, step, fill, start=None, end=None):
+    """ Adds the empty buckets between <start> and <end> with the fill value. """
+    keys, values = _list(keys), _list(values)
+    if not keys and (start is None or end is None):
+        return keys, values
+    first = keys[0] if start is None else start - start % step
+    last = keys[-1] if end is None else end - end % step
+    known = dict(zip(keys, values))
+    fill = None if fill == 'null' else fill
+    out = list(range(first, last + 1, step))
+    return out, [known.get(b, fill) for b in out]
+
+
+def rollup(timestamps, values, interval, aggr='avg', fill=None, start=None, end=None):
+    """ Aggregates the points of a serie in buckets of <interval>.
+
+    Parameters
+    ----------
+    'timestamps' : array, required
+        Integer timestamps (seconds or milliseconds) or datetime objects.
+
+    'values' : array, required
+        The values of the points.
+
+    'interval' : string or int, required
+        The width of the buckets, e.g. '5m', '1h' (or seconds).
+
+    'aggr' : string, optional (default=avg)
+        sum, avg, min, max, count, first, last, dev or a percentile (p50, p95,
+        p999 for 99.9).
+
+    'fill' : number, string or dict, optional (default=None)
+        Value of the empty buckets: None skips them, 0, a number, 'nan',
+        'null' (None values) or a policy built by ``build_policy``.
+
+    'start', 'end' : int, optional (default=None)
+        Range of the filled buckets, in the unit of the timestamps. By default
+        the buckets of the first and last points.
+
+    Returns the bucket timestamps (the start of each bucket, in the unit of
+    the input) and the aggregated values, as NumPy arrays when available
+    and no fill is needed, else lists.
+    """
+    _check_aggr(aggr)
+    assert len(timestamps) == len(values), \
+        'Field <timestamps> dont fit field <values>.'
+    ts = _epoch(timestamps)
+    step = _step(interval, ts)
+    if not len(ts):
+        keys, vs = [], []
+    elif np is not None:
+        keys, vs = _np_rollup(ts, values, step, aggr)
+    else:
+        keys, vs = _py_rollup(ts, values, step, aggr)
+    fill = _fill_value(fill)
+    if fill is not None:
+        keys, vs = _fill(keys, vs, step, fill, start, end)
+    return keys, vs
+
+
+def _series(result):
+    """ The series of a query result (dict, list of dicts or Series). """
+    if isinstance(result, dict) and 'results' in result:
+        result = result['results']
+    if isinstance(result, dict) or hasattr(result, 'timestamps'):
+        return [result]
+    return list(result)
+
+
+class Rollup(object):
+    """ Re-rolls pre-fetched high-resolution series to several resolutions
+    without querying the TSD again, e.g. for the zoom levels of a chart.
+
+    The rolled levels are cached. A new level of sum, min, max or count is
+    computed from the finest cached level of the same aggregator whose
+    interval divides the new one, and avg from the sum and count levels;
+    the other aggregators are computed from the raw points.
+
+    Parameters
+    ----------
+    'result' : dict or array, required
+        The result of ``query`` (with ``tsd=False``, ``arrays=True`` or
+        ``compact=True``) or its list of series.
+
+    Example
+    -------
+    >>> r = Rollup(c.query(queries, start='7d-ago', tsd=False))
+    >>> hourly = r.at('1h', 'avg')
+    >>> daily_max = r.at('1d', 'max', fill='nan')
+    """
+
+    def __init__(self, result):
+        self.series = []
+        for s in _series(result):
+            self.series.append({
+                'metric': s['metric'],
+                'tags': s['tags'],
+                'timestamps': _list(_epoch(s['timestamps'])),
+                'values': [float(v) for v in _list(s['values'])]
+            })
+        self._levels = {}
+
+    def _level(self, interval, aggr):
+        """ The (timestamps, values) of each serie rolled up without fill. """
+        step = timeutil.interval(interval)
+        key = (step, aggr)
+        if key in self._levels:
+            return self._levels[key]
+
+        if aggr == 'avg':
+            sums = self._level(interval, 'sum')
+            counts = self._level(interval, 'count')
+            level = [(ts, [s / c for s, c in zip(vs, cs)])
+                     for (ts, vs), (_, cs) in zip(sums, counts)]
+        else:
+            base = None
+            if aggr in _DECOMPOSABLE:
+                finer = [k[0] for k in self._levels
+                         if k[1] == aggr and k[0] < step and step % k[0] == 0]
+                if finer:
+                    base = self._levels[(max(finer), aggr)]
+            if base is not None:
+                again = _DECOMPOSABLE[aggr]
+                level = [tuple(map(_list, rollup(ts, vs, interval, again))) for ts, vs in base]
+            else:
+                level = [tuple(map(_list, rollup(s['timestamps'], s['values'], interval, aggr)))
+                         for s in self.series]
+        self._levels[key] = level
+        return level
+
+    def at(self, interval, aggr='avg', fill=None, start=None, end=None):
+        """ Returns the series rolled up in buckets of <interval>, in the
+        format of ``query`` with integer timestamps. See :func:`rollup` for
+        the parameters. """
+        _check_aggr(aggr)
+        level = self._level(interval, aggr)
+        fill = _fill_value(fill)
+        results = []
+        for s, (ts, vs) in zip(self.series, level):
+            if fill is not None:
+                ts, vs = _fill(ts, vs, _step(interval, s['timestamps']), fill, start, end)
+            results.append({'metric': s['metric'], 'tags': s['tags'],
+                'timestamps': ts, 'values': vs})
+        return results
+
+    def levels(self, intervals, aggr='avg', fill=None):
+        """ Rolls up the series to each interval, finest first. Returns a dict
+        of the results keyed on the intervals. """
+        ordered = sorted(intervals, key=timeutil.interval)
+        return dict((i, self.at(i, aggr, fill)) for i in ordered)
+
+    def clear(self):
+        """ Drops the cached levels. """
+        self._levels = {}
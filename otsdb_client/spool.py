@@ -0,0 +1,225 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import threading
+import time
+
+from json import loads
+from logging import info
+
+from otsdb_client import encoder
+
+
+class Spool(object):
+    """ On-disk spool of the put batches that could not be stored.
+
+    Each batch is appended as one line (the JSON body of the /api/put
+    request) to a segment file in <path>. Segments are rotated at
+    <segment_bytes> and the oldest ones are dropped when the spool grows
+    beyond <max_bytes>. A background drainer replays the segments, at most
+    <rate> batches per second, once the TSD answers again.
+
+    Parameters
+    ----------
+    'path' : string, required
+        Directory of the segment files. It is created if needed.
+
+    'segment_bytes' : int, optional (default=16MB)
+        Size of a segment before it is rotated.
+
+    'max_bytes' : int, optional (default=1GB)
+        Maximum size of the spool.
+
+    'rate' : float, optional (default=50)
+        Maximum number of batches replayed per second.
+
+    'interval' : float, optional (default=5)
+        Seconds between the checks of the drainer.
+    """
+
+    SUFFIX = '.spool'
+
+    def __init__(self, path, segment_bytes=16 * 1024 ** 2, max_bytes=1024 ** 3,
+        rate=50, interval=5):
+        assert segment_bytes > 0, 'Field <segment_bytes> must be greater than 0.'
+        assert max_bytes >= segment_bytes, \
+            'Field <max_bytes> must not be lower than <segment_bytes>.'
+        assert rate > 0, 'Field <rate> must be greater than 0.'
+
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.rate = rate
+        self.interval = interval
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+        self._current = None
+        self._draining = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _segment_name(self):
+        return os.path.join(self.path, '%020d%s' % (int(time.time() * 1e6), self.SUFFIX))
+
+    def segments(self):
+        """ The segment files, oldest first. """
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path)
+                      if f.endswith(self.SUFFIX))
+
+    def size(self):
+        """ Size of the spool in bytes. """
+        return sum(os.path.getsize(f) for f in self.segments())
+
+    def append(self, points):
+        """ Spools one batch of encoded points. """
+        line = (encoder.body(points) + '\n').encode('utf-8')
+        with self._lock:
+            if self._current is None or \
+                    os.path.getsize(self._current) + len(line) > self.segment_bytes:
+                self._rotate()
+            with open(self._current, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.spooled += len(points)
+
+    def _rotate(self):
+        self._current = self._segment_name()
+        open(self._current, 'ab').close()
+        segments = self.segments()
+        total = sum(os.path.getsize(f) for f in segments)
+        # Make room for a full segment, dropping the oldest data but neither
+        # the new segment nor the one being replayed
+        droppable = [f for f in segments if f not in (self._current, self._draining)]
+        while total + self.segment_bytes > self.max_bytes and droppable:
+            oldest = droppable.pop(0)
+            total -= os.path.getsize(oldest)
+            with open(oldest, 'rb') as f:
+                lost = sum(len(loads(l)) for l in f if l.strip())
+            os.remove(oldest)
+            self.dropped += lost
+            info('Spool is full, %d points of %s were dropped' % (lost, oldest))
+
+    def _take(self):
+        """ Returns the oldest segment, rotating the current one if needed.
+        The segment is kept from the rotation until :meth:`_release`. """
+        with self._lock:
+            segments = self.segments()
+            if not segments:
+                return None
+            if segments[0] == self._current:
+                self._current = None
+            self._draining = segments[0]
+            return segments[0]
+
+    def _release(self):
+        with self._lock:
+            self._draining = None
+
+    def drain(self, conn, att=1):
+        """ Replays the spooled batches through <conn>.
+
+        The points the TSD rejects for good are dropped. Stops at the first
+        batch whose points could not be sent: only those points are kept,
+        with the batches after them, for the next drain. Returns True when
+        the spool is empty.
+        """
+        while True:
+            segment = self._take()
+            if segment is None:
+                return True
+            try:
+                if not self._replay(segment, conn, att):
+                    return False
+            finally:
+                self._release()
+
+    def _replay(self, segment, conn, att):
+        """ Replays one segment. Returns True when all its points were sent. """
+        with open(segment, 'rb') as f:
+            lines = [l.decode('utf-8').rstrip('\n') for l in f if l.strip()]
+
+        left = []
+        for n, line in enumerate(lines):
+            started = time.time()
+            points = conn._split_body(line)
+            pending = []
+            rejected, _ = conn._put_batches([points], att=att, keep=pending)
+            if rejected:
+                self.dropped += rejected
+                info('%d spooled points were rejected by the TSD and dropped' % rejected)
+            self.replayed += len(points) - rejected - sum(map(len, pending))
+            if pending:
+                left = [encoder.body(b) for b in pending] + lines[n + 1:]
+                break
+            wait = 1.0 / self.rate - (time.time() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+        if left:
+            tmp = segment + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(('\n'.join(left) + '\n').encode('utf-8'))
+            os.rename(tmp, segment)
+            return False
+        os.remove(segment)
+        return True
+
+    def start(self, conn):
+        """ Starts the background drainer, replaying the spool whenever the
+        TSD accepts connections again. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(conn,),
+            name='otsdb-spool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the background drainer. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, conn):
+        while not self._stop.wait(self.interval):
+            if not self.segments():
+                continue
+            try:
+                conn.ping()
+            except Exception:
+                continue
+            try:
+                self.drain(conn)
+            except Exception as err:
+                info('Spool drain failed: %s' % err)
+
+    def stats(self):
+        """ Counters of points spooled, replayed and dropped. """
+        return {
+            'spooled': self.spooled,
+            'replayed': self.replayed,
+            'dropped': self.dropped,
+            'segments': len(self.segments()),
+            'bytes': self.size()
+        }
@@ -0,0 +1,155 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import codecs
+import re
+
+from json import loads
+
+# Characters that change the nesting state outside and inside JSON strings
+_STRUCT = re.compile(r'["{}\[\]]')
+_STRING = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]\s]')
+
+# Returned by the scanner while an element is incomplete
+_MORE = object()
+
+
+class ArrayParser(object):
+    """ Incremental parser of a top-level JSON array.
+
+    Chunks of the document are given to :meth:`feed`, which returns the
+    elements of the array completed so far. Only the element being parsed is
+    kept in memory, so a response can be decoded one series at a time.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0         # Scan position in the buffer
+        self._start = None    # Start of the current element
+        self._depth = 0       # Nesting depth inside the current element
+        self._in_string = False
+        self._opened = False
+        self.done = False
+
+    def feed(self, chunk):
+        """ Adds a chunk (bytes or str) and returns the completed elements. """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        self._buf += chunk
+        items = []
+        while not self.done:
+            item = self._next()
+            if item is _MORE:
+                break
+            items.append(item)
+        self._compact()
+        return items
+
+    def close(self):
+        """ Checks that the document ended with the array. """
+        assert self.done or (not self._opened and not self._buf.strip()), \
+            'The JSON response is truncated.'
+
+    def _compact(self):
+        # Drop the consumed part of the buffer
+        cut = self._pos if self._start is None else self._start
+        if cut:
+            self._buf = self._buf[cut:]
+            self._pos -= cut
+            if self._start is not None:
+                self._start -= cut
+
+    def _skip(self, chars):
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _next(self):
+        if not self._opened:
+            if not self._skip(' \t\r\n'):
+                return _MORE
+            assert self._buf[self._pos] == '[', 'The JSON response is not an array.'
+            self._opened = True
+            self._pos += 1
+
+        if self._start is None:
+            if not self._skip(' \t\r\n,'):
+                return _MORE
+            if self._buf[self._pos] == ']':
+                self._pos += 1
+                self.done = True
+                return _MORE
+            if self._buf[self._pos] not in '{["':
+                # Number or literal element: decoded up to the next separator
+                end = _SCALAR_END.search(self._buf, self._pos)
+                if end is None:
+                    return _MORE
+                item = loads(self._buf[self._pos:end.start()])
+                self._pos = end.start()
+                return item
+            self._start = self._pos
+
+        buf = self._buf
+        while True:
+            if self._in_string:
+                m = _STRING.search(buf, self._pos)
+                if m is None:
+                    self._pos = len(buf)
+                    return _MORE
+                if m.group() == '\\':
+                    if m.end() >= len(buf):
+                        # The escaped char is in the next chunk
+                        self._pos = m.start()
+                        return _MORE
+                    self._pos = m.end() + 1
+                    continue
+                self._in_string = False
+                self._pos = m.end()
+                if self._depth == 0:
+                    return self._element()
+                continue
+
+            m = _STRUCT.search(buf, self._pos)
+            if m is None:
+                self._pos = len(buf)
+                return _MORE
+            self._pos = m.end()
+            c = m.group()
+            if c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._element()
+
+    def _element(self):
+        item = loads(self._buf[self._start:self._pos])
+        self._start = None
+        return item
+
+
+def iter_array(chunks):
+    """ Yields the elements of a JSON array read from an iterable of chunks. """
+    parser = ArrayParser()
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    parser.close()
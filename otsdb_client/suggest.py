@@ -0,0 +1,151 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from logging import info
+
+
+class SuggestIndex(object):
+    """ In-process index of the metric names, tag keys and tag values, answering
+    the prefix lookups of ``suggest`` without a round trip to the TSD.
+
+    Each type is bulk-loaded once with a single /api/suggest request and kept
+    as a sorted list: a lookup is a binary search on the prefix. A background
+    thread loads the lists again every <refresh> seconds and merges the new
+    names; names removed from the TSD stay until :meth:`clear`. A type whose
+    list reached <limit> names is incomplete and its lookups go to the TSD.
+
+    Parameters
+    ----------
+    'refresh' : float, optional (default=300)
+        Seconds between the loads of the background thread.
+
+    'limit' : int, optional (default=100000)
+        The <max> of the bulk /api/suggest requests.
+    """
+
+    TYPES = ('metrics', 'tagk', 'tagv')
+
+    def __init__(self, refresh=300, limit=100000):
+        assert refresh > 0, 'Field <refresh> must be greater than 0.'
+        assert limit > 0, 'Field <limit> must be greater than 0.'
+
+        self.refresh = refresh
+        self.limit = limit
+        self.loaded = None
+        self._names = dict((t, []) for t in self.TYPES)
+        self._complete = dict((t, False) for t in self.TYPES)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self, type, names):
+        """ Merges <names> in the index of <type>. Returns the number of new
+        names. """
+        assert type in self.TYPES, 'Field <type> must be metrics, tagk or tagv.'
+        with self._lock:
+            old = self._names[type]
+            known = set(old)
+            new = sorted(set(n for n in names if n not in known))
+            if new:
+                # Lookups read the list without the lock: swap in a new one
+                self._names[type] = list(heapq.merge(old, new))
+        return len(new)
+
+    def load(self, fetch):
+        """ Loads every type with fetch(type, limit), which returns the names
+        (None when there are none, False when the request failed). True when
+        every type was loaded. """
+        ok = True
+        for t in self.TYPES:
+            names = fetch(t, self.limit)
+            if names is False:
+                ok = False
+                continue
+            names = names or []
+            self.update(t, names)
+            self._complete[t] = len(names) < self.limit
+            if not self._complete[t]:
+                info('Suggest index of %s truncated at %d names' % (t, self.limit))
+        if ok:
+            self.loaded = time.time()
+        return ok
+
+    def open(self, fetch):
+        """ Loads the index and starts the background thread, on first use. """
+        if self._thread is None:
+            self.load(fetch)
+            self.start(fetch)
+
+    def lookup(self, type='metrics', q='', max=9999):
+        """ Returns the names of <type> starting with <q>, sorted, at most
+        <max>. None when the index can't answer (not loaded or incomplete). """
+        if not self.loaded or not self._complete.get(type):
+            return None
+        names = self._names[type]
+        n = bisect_left(names, q)
+        found = []
+        while n < len(names) and len(found) < int(max) and names[n].startswith(q):
+            found.append(names[n])
+            n += 1
+        return found
+
+    def stale(self):
+        """ True when the index was never loaded or is older than <refresh>. """
+        return not self.loaded or time.time() - self.loaded >= self.refresh
+
+    def start(self, fetch):
+        """ Starts the background thread loading the index every <refresh>
+        seconds. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(fetch,),
+            name='otsdb-suggest')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the background thread. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, fetch):
+        while not self._stop.wait(self.refresh):
+            try:
+                self.load(fetch)
+            except Exception as err:
+                info('Suggest index refresh failed: %s' % err)
+
+    def clear(self):
+        """ Empties the index. The lookups go to the TSD until the next load. """
+        with self._lock:
+            self._names = dict((t, []) for t in self.TYPES)
+            self._complete = dict((t, False) for t in self.TYPES)
+            self.loaded = None
+
+    def stats(self):
+        """ Number of names of each type and the age of the index. """
+        return {
+            'names': dict((t, len(n)) for t, n in self._names.items()),
+            'complete': dict(self._complete),
+            'age': time.time() - self.loaded if self.loaded else None
+        }
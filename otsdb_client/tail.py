@@ -0,0 +1,115 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from collections import deque
+
+from otsdb_client import timeutil
+
+
+class Tail(object):
+    """ Follows queries, fetching only the points added since the last call.
+
+    The first :meth:`refresh` reads the whole <window>. The next ones only
+    request the points after the last timestamp seen and append them to a
+    ring buffer of <size> points per series.
+
+    Parameters
+    ----------
+    'conn' : Connection, required
+        The connection used to query.
+
+    'queries' : array, required
+        The queries, in the format of :meth:`Connection.query`.
+
+    'window' : string, optional (default=1h-ago)
+        The start time of the first refresh.
+
+    'size' : int, optional (default=3600)
+        Maximum number of points kept per series.
+    """
+
+    def __init__(self, conn, queries, window='1h-ago', size=3600):
+        assert size > 0, 'Field <size> must be greater than 0.'
+        self.conn = conn
+        self.queries = queries
+        self.window = window
+        self.size = size
+        self._series = {}
+        self._last = {}
+
+    def _key(self, serie):
+        return (serie['metric'], tuple(sorted(serie['tags'].items())))
+
+    def start(self):
+        """ The start time of the next refresh: after the oldest last point of
+        the series still reporting, and never before <window>. The series
+        whose last point is older than the window no longer hold it back. """
+        if not self._last:
+            return self.window
+        floor = timeutil.to_millis(self.window)
+        if max(self._last.values()) < 1e12:
+            # Timestamps in seconds
+            floor = -(-floor // 1000)
+        for key in [k for k, t in self._last.items() if t < floor]:
+            del self._last[key]
+        if not self._last:
+            return floor
+        return max(min(self._last.values()) + 1, floor)
+
+    def refresh(self):
+        """ Fetches the new points. Returns how many points were added. """
+        res = self.conn.query(self.queries, start=self.start(), end='now',
+            arrays=True)
+        if not res:
+            return 0
+
+        added = 0
+        for serie in res['results']:
+            key = self._key(serie)
+            buf = self._series.get(key)
+            if buf is None:
+                buf = self._series[key] = {
+                    'metric': serie['metric'],
+                    'tags': serie['tags'],
+                    'timestamps': deque(maxlen=self.size),
+                    'values': deque(maxlen=self.size)
+                }
+            last = self._last.get(key)
+            for t, v in zip(serie['timestamps'], serie['values']):
+                t = int(t)
+                if last is not None and t <= last:
+                    continue
+                buf['timestamps'].append(t)
+                buf['values'].append(float(v))
+                last = t
+                added += 1
+            if last is not None:
+                self._last[key] = last
+        return added
+
+    def series(self):
+        """ Returns the buffered series in the format of :meth:`Connection.query`
+        with integer timestamps. """
+        return [{
+            'metric': b['metric'],
+            'tags': b['tags'],
+            'timestamps': list(b['timestamps']),
+            'values': list(b['values'])
+        } for b in self._series.values()]
+
+    def reset(self):
+        """ Drops the buffers: the next refresh reads the whole window again. """
+        self._series = {}
+        self._last = {}
@@ -0,0 +1,222 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import threading
+import time
+
+from gevent.monkey import get_original
+from json import loads
+from logging import info
+
+# grequests monkey-patches socket and select, but the connections are shared
+# by the threads of the writer: use the standard library ones.
+socket, = get_original('socket', ['socket'])
+select, = get_original('select', ['select'])
+IPPROTO_TCP, TCP_NODELAY = get_original('socket', ['IPPROTO_TCP', 'TCP_NODELAY'])
+
+# Telnet formats of the recently written series, keyed on their JSON prefix
+_formats = {}
+_MAX_FORMATS = 10000
+
+
+def _format(head):
+    """ Returns the metric and tags parts of the telnet lines of a series,
+    from the prefix of its encoded points (see :func:`otsdb_client.encoder.prefix`). """
+    fmt = _formats.get(head)
+    if fmt is None:
+        dp = loads(head + '0}')
+        tags = ' '.join('%s=%s' % kv for kv in dp['tags'].items())
+        fmt = ('put %s ' % dp['metric'], ' %s\n' % tags)
+        if len(_formats) >= _MAX_FORMATS:
+            _formats.clear()
+        _formats[head] = fmt
+    return fmt
+
+
+def _scalar(text):
+    # Strings are the only JSON scalars not written as is
+    return loads(text) if text.startswith('"') else text
+
+
+class TelnetTransport(object):
+    """ Sends put batches with the telnet-style protocol of the TSD.
+
+    The points are written as ``put <metric> <timestamp> <value> <tagk=tagv>``
+    lines on long-lived TCP connections, without waiting for any answer: the
+    TSD only writes back the lines it rejects, which are logged and counted.
+    The batches are spread round-robin over <connections> sockets and
+    written in chunks of about <buffer_bytes>. A broken connection is opened
+    again and its pending chunk written again, following the retry policy of
+    the caller.
+
+    Unlike /api/put, a point rejected by the TSD is not reported to the
+    caller, and the points written just before the TSD goes down may be lost.
+
+    Parameters
+    ----------
+    'server' : string, required
+        The IP address or URI of the server.
+
+    'port' : int, optional (default=4242)
+        The port that TSD is running.
+
+    'connections' : int, optional (default=1)
+        Number of TCP connections.
+
+    'timeout' : float, optional (default=10)
+        Timeout in seconds of the connection and of each write.
+
+    'buffer_bytes' : int, optional (default=64KB)
+        Size of the chunks written to the sockets.
+    """
+
+    def __init__(self, server, port=4242, connections=1, timeout=10,
+        buffer_bytes=64 * 1024):
+        assert connections > 0, 'Field <connections> must be greater than 0.'
+        assert buffer_bytes > 0, 'Field <buffer_bytes> must be greater than 0.'
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.buffer_bytes = buffer_bytes
+        self._socks = [None] * connections
+        self._opened = [False] * connections
+        self._locks = [threading.Lock() for _ in range(connections)]
+        self._next = itertools.count()
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.reconnects = 0
+
+    def _line(self, point):
+        # The tags are the last object before the timestamp: strings escape
+        # their quotes, so the marker can't be found inside one
+        cut = point.index('},"timestamp":') + 14
+        put, tags = _format(point[:cut])
+        ts, value = point[cut:-1].split(',"value":', 1)
+        return '%s%s %s%s' % (put, _scalar(ts), _scalar(value), tags)
+
+    def lines(self, batch):
+        """ The telnet lines of a batch of encoded points. """
+        return ''.join(self._line(p) for p in batch)
+
+    def _connect(self, i):
+        sock = socket()
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect((self.server, self.port))
+        except Exception:
+            sock.close()
+            raise
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        if self._opened[i]:
+            with self._stats_lock:
+                self.reconnects += 1
+        self._socks[i] = sock
+        self._opened[i] = True
+        return sock
+
+    def _drop(self, i):
+        sock, self._socks[i] = self._socks[i], None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    def _read_errors(self, sock):
+        """ Consumes the error lines written back by the TSD. Raises an
+        exception when the TSD closed the connection. """
+        while select([sock], [], [], 0)[0]:
+            data = sock.recv(65536)
+            if not data:
+                raise IOError('Connection closed by the TSD')
+            for line in data.decode('utf-8', 'replace').splitlines():
+                if line.strip():
+                    with self._stats_lock:
+                        self.rejected += 1
+                    info('TSD rejected a put: %s' % line)
+
+    def _write(self, i, data):
+        """ Writes <data> on the connection <i>, opening it if needed. """
+        with self._locks[i]:
+            sock = self._socks[i]
+            if sock is None:
+                sock = self._connect(i)
+            try:
+                self._read_errors(sock)
+                sock.sendall(data)
+                self._read_errors(sock)
+            except Exception:
+                self._drop(i)
+                raise
+
+    def send(self, batches, policy, verbose=False):
+        """ Writes the batches of encoded points. Returns the batches that
+        could not be written after the attempts of <policy>. """
+        chunks, chunk, size = [], [], 0
+        for b in batches:
+            if not b:
+                continue
+            chunk.append(b)
+            size += sum(map(len, b))
+            if size >= self.buffer_bytes:
+                chunks.append(chunk)
+                chunk, size = [], 0
+        if chunk:
+            chunks.append(chunk)
+
+        pending = []
+        for chunk in chunks:
+            data = ''.join(self.lines(b) for b in chunk).encode('utf-8')
+            attempt = 0
+            while True:
+                i = next(self._next) % len(self._socks)
+                attempt += 1
+                try:
+                    self._write(i, data)
+                except Exception as err:
+                    if verbose:
+                        print('Attempt %d: telnet write failed: %s' % (attempt, err))
+                    if attempt >= policy.attempts:
+                        info('Telnet put failed after %d attempts: %s' % (attempt, err))
+                        pending.extend(chunk)
+                        break
+                    time.sleep(policy.delay(attempt))
+                    continue
+                with self._stats_lock:
+                    self.sent += sum(map(len, chunk))
+                    self.bytes += len(data)
+                break
+        return pending
+
+    def close(self):
+        """ Closes the connections. """
+        for i, lock in enumerate(self._locks):
+            with lock:
+                self._drop(i)
+                self._opened[i] = False
+
+    def stats(self):
+        """ Counters of points written, bytes, lines rejected by the TSD and
+        reconnections. """
+        return {
+            'connections': sum(1 for s in self._socks if s is not None),
+            'sent': self.sent,
+            'bytes': self.bytes,
+            'rejected': self.rejected,
+            'reconnects': self.reconnects
+        }
@@ -0,0 +1,116 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Conversions of the OpenTSDB time formats to epoch milliseconds. """
+
+import re
+import time
+from datetime import datetime
+
+# Milliseconds of the OpenTSDB time units
+UNITS = {
+    'ms': 1,
+    's': 1000,
+    'm': 60 * 1000,
+    'h': 3600 * 1000,
+    'd': 86400 * 1000,
+    'w': 7 * 86400 * 1000,
+    'n': 30 * 86400 * 1000,
+    'y': 365 * 86400 * 1000,
+}
+
+_INTERVAL = re.compile(r'^(\d+)(ms|s|m|h|d|w|n|y)$')
+_RELATIVE = re.compile(r'^(\d+)(ms|s|m|h|d|w|n|y)-ago$')
+_ABSOLUTE = ['%Y/%m/%d-%H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d-%H:%M',
+             '%Y/%m/%d %H:%M', '%Y/%m/%d']
+
+
+def now_millis():
+    return int(round(time.time() * 1000))
+
+
+def interval(value):
+    """ Converts an interval ('30m', '1d', ... or seconds) to milliseconds. """
+    if isinstance(value, (int, float)):
+        return int(value * 1000)
+    m = _INTERVAL.match(str(value).strip())
+    assert m, 'Field <interval> is not valid.'
+    return int(m.group(1)) * UNITS[m.group(2)]
+
+
+def is_relative(value):
+    """ True when the time depends on the current time ('now', '1h-ago'). """
+    if value is None:
+        return True
+    if isinstance(value, str):
+        value = value.strip()
+        return value == 'now' or bool(_RELATIVE.match(value))
+    return False
+
+
+def to_millis(value, now=None):
+    """ Converts an OpenTSDB time to epoch milliseconds.
+
+    Accepts 'now', relative times ('1h-ago'), absolute dates
+    ('2016/01/02-10:00:00'), datetime objects and epoch timestamps in
+    seconds or milliseconds (as int or string).
+    """
+    if now is None:
+        now = now_millis()
+    if value is None:
+        return now
+    if isinstance(value, datetime):
+        return int(time.mktime(value.timetuple()) * 1000 + value.microsecond // 1000)
+    if isinstance(value, (int, float)):
+        # Same rule as OpenTSDB: 13 digits timestamps are in milliseconds
+        return int(value) if value >= 1e12 else int(value * 1000)
+
+    value = str(value).strip()
+    if value == 'now':
+        return now
+    m = _RELATIVE.match(value)
+    if m:
+        return now - int(m.group(1)) * UNITS[m.group(2)]
+    if value.isdigit():
+        return to_millis(int(value))
+    for fmt in _ABSOLUTE:
+        try:
+            return to_millis(datetime.strptime(value, fmt))
+        except ValueError:
+            pass
+    assert False, 'Time <%s> is not valid.' % value
+
+
+def split(start, end, step, align=None):
+    """ Splits the [start, end] window in consecutive windows of <step>.
+
+    All the values are epoch milliseconds. The windows do not overlap: each
+    one ends 1 ms before the next starts, since OpenTSDB includes both ends.
+    With <align>, the step is rounded up to a multiple of <align> and the
+    windows are cut on multiples of <align>, so no downsample bucket of that
+    interval spans two windows.
+    """
+    assert step > 0, 'Field <step> must be greater than 0.'
+    assert start <= end, 'Field <start> must not be after <end>.'
+    if align:
+        step = -(-step // align) * align
+        cut = start - start % align + step
+    else:
+        cut = start + step
+    windows = []
+    while start <= end:
+        windows.append((start, min(cut - 1, end)))
+        start, cut = cut, cut + step
+    return windows
@@ -0,0 +1,193 @@
+# Copyright 2016: Venidera Research & Development.
+# All Rights Reserved.
+#
+# Licensed under the GNU General Public License, Version 3.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+from gevent.monkey import get_original
+from logging import info
+
+# grequests monkey-patches the queue module, but the writer hands points
+# between real threads, so it needs the thread-safe standard queue.
+Queue, Empty, Full = get_original('queue', ['Queue', 'Empty', 'Full'])
+
+_STOP = object()
+
+
+class Writer(object):
+    """ Background writer that batches points into /api/put requests.
+
+    Points are accepted by :meth:`submit` without waiting for the HTTP round
+    trip. Worker threads coalesce them into batches of <ptcl> points, waiting
+    at most <linger> seconds for a batch to fill, and send up to <pipeline>
+    batches concurrently.
+
+    Parameters
+    ----------
+    'conn' : Connection, required
+        The connection used to send the batches.
+
+    'ptcl' : int, optional (default=20)
+        Number of points sent per http request.
+
+    'linger' : float, optional (default=1.0)
+        Maximum time in seconds a point waits for its batch to fill.
+
+    'maxsize' : int, optional (default=100000)
+        Maximum number of points held in the queue. When the queue is full
+        :meth:`submit` blocks (backpressure) or raises ``Full``.
+
+    'workers' : int, optional (default=1)
+        Number of worker threads.
+
+    'pipeline' : int, optional (default=10)
+        Maximum number of batches sent concurrently by each worker.
+
+    'att' : int, optional (default=5)
+        Number of HTTP request attempts.
+    """
+
+    def __init__(self, conn, ptcl=20, linger=1.0, maxsize=100000, workers=1,
+        pipeline=10, att=5):
+        assert ptcl > 0, 'Field <ptcl> must be greater than 0.'
+        assert linger >= 0, 'Field <linger> must not be negative.'
+        assert workers > 0, 'Field <workers> must be greater than 0.'
+        assert pipeline > 0, 'Field <pipeline> must be greater than 0.'
+
+        self.conn = conn
+        self.ptcl = ptcl
+        self.linger = linger
+        self.pipeline = pipeline
+        self.att = att
+        self.closed = False
+
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.spooled = 0
+
+        self._queue = Queue(maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        for n in range(workers):
+            t = threading.Thread(target=self._run, name='otsdb-writer-%d' % n)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, metric, value, timestamp=None, tags=dict(), block=True,
+        timeout=None):
+        """ Enqueues one point to be sent in background.
+
+        Parameters
+        ----------
+        'metric' : string, required
+            The name of the metric you are storing.
+
+        'value' : number, required
+            The value to record.
+
+        'timestamp' : int or datetime, optional (default=current time)
+            A Unix epoch style timestamp in seconds or milliseconds.
+
+        'tags' : map, required (default=dict())
+            A map of tag name/tag value pairs.
+
+        'block' : boolean, optional (default=True)
+            Wait for room in the queue when it is full.
+
+        'timeout' : float, optional (default=None)
+            Maximum time waiting for room in the queue. ``Full`` is
+            raised when it expires or when <block> is False.
+        """
+        assert not self.closed, 'The writer is closed.'
+        point = self.conn._put_point(metric, timestamp, value, tags)
+        self._queue.put(point, block, timeout)
+        with self._lock:
+            self.submitted += 1
+
+    def qsize(self):
+        """ Number of points waiting in the queue. """
+        return self._queue.qsize()
+
+    def flush(self):
+        """ Blocks until every submitted point was sent (or given up). """
+        self._queue.join()
+
+    def close(self):
+        """ Flushes the pending points and stops the worker threads. """
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+
+    def stats(self):
+        """ Counters of points submitted, sent, failed and spooled. """
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'sent': self.sent,
+                'failed': self.failed,
+                'spooled': self.spooled,
+                'queued': self._queue.qsize()
+            }
+
+    def _run(self):
+        limit = self.ptcl * self.pipeline
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            points = [item]
+            deadline = time.time() + self.linger
+            while len(points) < limit:
+                remaining = deadline - time.time()
+                # Only linger while the first batch is not yet full
+                if len(points) >= self.ptcl:
+                    remaining = 0
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(True, remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    running = False
+                    self._queue.task_done()
+                    break
+                points.append(item)
+
+            self._send(points)
+
+    def _send(self, points):
+        batches = [points[i:i + self.ptcl] for i in range(0, len(points), self.ptcl)]
+        try:
+            failed, spooled = self.conn._put_batches(batches, att=self.att)
+        except Exception as err:
+            info('Writer failed to send %d points: %s' % (len(points), err))
+            failed, spooled = len(points), 0
+        with self._lock:
+            self.sent += len(points) - failed - spooled
+            self.failed += failed
+            self.spooled += spooled
+        for _ in points:
+            self._queue.task_done()
@@ -21,7 +21,9 @@ if __name__ == '__main__':
         keywords="opentsdb, tsdb, time series",
         url="http://github.com/venidera/otsdb_client",
         packages=find_packages(),
+        python_requires='>=3.7',
         install_requires=['grequests==0.3.0'],
+        extras_require={'async': ['aiohttp'], 'numpy': ['numpy']},
         long_description=read_md('README.md'),
         classifiers=[
             "Development Status :: 5 - Production/Stable",